@@ -0,0 +1,68 @@
+"""
+Scaling of utils.tracking.associate from 1 to 500 boxes, against the former
+per-pair iou_tracker loop (which also kept only the first assignment).
+
+$ python3 -m benchmarks.associate
+"""
+import argparse
+import json
+import time
+import numpy as np
+
+from scipy.optimize import linear_sum_assignment
+from utils.tracking import associate, iou_tracker
+
+
+def associate_loop(detections, trackers, iou_threshold=0.3):
+    iou_matrix = np.zeros((len(detections), len(trackers)), dtype=np.float32)
+    for d, det in enumerate(detections):
+        for t, trk in enumerate(trackers):
+            iou_matrix[d, t] = iou_tracker(trk, det)
+
+    indices = linear_sum_assignment(-iou_matrix)
+    matched_indices = np.array([[indices[0][0], indices[1][0]]])
+    unmatched_detections = [d for d in range(len(detections)) if d not in matched_indices[:, 0]]
+    unmatched_trackers = [t for t in range(len(trackers)) if t not in matched_indices[:, 1]]
+
+    return matched_indices, unmatched_detections, unmatched_trackers
+
+
+def boxes(rng, n, jitter=None):
+    corners = rng.uniform(0, 2000, (n, 2)) if jitter is None else jitter[:, :2] + rng.normal(0, 2, (n, 2))
+    sizes = rng.uniform(20, 60, (n, 2)) if jitter is None else jitter[:, 2:4] - jitter[:, :2]
+    return np.hstack((corners, corners + sizes, np.zeros((n, 1))))
+
+
+def timed(fn, repeats, *args):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = fn(*args)
+
+    return (time.perf_counter() - start) / repeats * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--counts', type=int, nargs='+', default=[1, 2, 5, 10, 20, 50, 100, 200, 500])
+    parser.add_argument('--loop-max', type=int, default=200, help='skip the old loop above this count')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    report = []
+    for n in args.counts:
+        trackers = boxes(rng, n)
+        detections = boxes(rng, n, jitter=trackers)
+        repeats = max(1, 200 // n)
+
+        vectorized_ms, (matches, _, _) = timed(associate, repeats, detections, trackers)
+        row = {'boxes': n, 'vectorized_ms': round(vectorized_ms, 3), 'matches': len(matches)}
+        if n <= args.loop_max:
+            loop_ms, (loop_matches, _, _) = timed(associate_loop, 1, detections, trackers)
+            row.update({'loop_ms': round(loop_ms, 3), 'loop_matches': len(loop_matches)})
+        report.append(row)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
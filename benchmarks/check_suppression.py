@@ -0,0 +1,133 @@
+"""
+Checks that Tracker.hide_boxes suppression (compiled loop and NumPy matrix
+version) keeps exactly the boxes of the original pairwise loop, on a seeded
+corpus of track sets with duplicated, nested and overlapping boxes. Exits
+with 1 on the first mismatch.
+
+$ python3 -m benchmarks.check_suppression
+$ python3 -m benchmarks.check_suppression --corpus tracks.npz   # recorded sets
+"""
+import argparse
+import json
+import sys
+import time
+import numpy as np
+
+from utils.kernels import suppress, suppress_matrix
+from utils.tracking import iou_tracker
+
+
+def suppress_loop(detections, active=True):
+    # the former body of Tracker.hide_boxes
+    num_objects = detections.shape[0]
+    flags = np.ones(num_objects, dtype=np.uint8)
+
+    for idx_a in range(num_objects):
+        for idx_b in range(idx_a + 1, num_objects):
+            if flags[idx_b] == 0:
+                continue
+
+            if active:
+                if (detections[idx_a, 0] <= detections[idx_b, 0]) and (detections[idx_a, 1] <= detections[idx_b, 1]) and (
+                    detections[idx_a, 2] >= detections[idx_b, 2]) and (detections[idx_a, 3] >= detections[idx_b, 3]) and (
+                        detections[idx_b, 5] == 0):
+                    flags[idx_b] = 0
+                    continue
+                elif (detections[idx_a, 0] >= detections[idx_b, 0]) and (detections[idx_a, 1] >= detections[idx_b, 1]) and (
+                    detections[idx_a, 2] <= detections[idx_b, 2]) and (detections[idx_a, 3] <= detections[idx_b, 3]) and (
+                        detections[idx_a, 5] == 0):
+                    flags[idx_a] = 0
+                    break
+
+            iou = iou_tracker(detections[idx_a], detections[idx_b])
+            if iou >= 0.3:
+                if detections[idx_a, 5] == 0:
+                    flags[idx_a] = 0
+                    break
+                elif detections[idx_b, 5] == 0:
+                    flags[idx_b] = 0
+                    continue
+                else:
+                    flags[idx_a] = 0
+                    break
+
+    return flags
+
+
+def track_set(rng, n):
+    """ (n, 7) uint16 rows like the input of hide_boxes: pads, their echoes and clutter """
+    pads = rng.uniform(0, 280, (max(1, n // 6), 2))
+    sizes = rng.uniform(4, 60, (len(pads), 2))
+    boxes = []
+    for _ in range(n):
+        k = rng.integers(len(pads))
+        lo, size = pads[k], sizes[k]
+        kind = rng.integers(5)
+        if kind == 0:    # the same box again
+            box = np.hstack((lo, lo + size))
+        elif kind == 1:  # nested
+            shrink = rng.uniform(0, 0.4, 2) * size
+            box = np.hstack((lo + shrink, lo + size - shrink * rng.uniform(0, 1, 2)))
+        elif kind == 2:  # jittered
+            box = np.hstack((lo, lo + size)) + rng.normal(0, 3, 4)
+        elif kind == 3:  # degenerate
+            box = np.hstack((lo, lo + size * rng.integers(0, 2, 2)))
+        else:            # clutter
+            corner = rng.uniform(0, 300, 2)
+            box = np.hstack((corner, corner + rng.uniform(2, 80, 2)))
+        boxes.append(box)
+
+    boxes = np.clip(np.asarray(boxes).reshape(-1, 4), 0, None)
+    rows = np.column_stack((boxes, np.arange(1, n + 1), rng.integers(0, 2, n), np.zeros(n)))
+
+    return rows.astype(np.uint16)
+
+
+def timed(fn, detections, active):
+    start = time.perf_counter()
+    flags = fn(detections, active)
+
+    return flags, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sets', type=int, default=2000)
+    parser.add_argument('--max-boxes', type=int, default=60)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--corpus', help='npz of (n, 7) track sets to check instead of generated ones')
+    parser.add_argument('--record', help='save the generated corpus to this npz')
+    args = parser.parse_args()
+
+    if args.corpus:
+        corpus = list(np.load(args.corpus).values())
+    else:
+        rng = np.random.default_rng(args.seed)
+        corpus = [track_set(rng, int(rng.integers(1, args.max_boxes + 1))) for _ in range(args.sets)]
+        if args.record:
+            np.savez_compressed(args.record, *corpus)
+
+    np.seterr(invalid='ignore', divide='ignore')  # empty boxes in the corpus
+    seconds = {'loop': 0., 'kernel': 0., 'matrix': 0.}
+    for i, detections in enumerate(corpus):
+        for active in (True, False):
+            expected, elapsed = timed(suppress_loop, detections, active)
+            seconds['loop'] += elapsed
+            for name, fn in (('kernel', suppress), ('matrix', suppress_matrix)):
+                flags, elapsed = timed(fn, detections, active)
+                seconds[name] += elapsed
+                if not np.array_equal(flags, expected):
+                    print(f"set {i} (active={active}): {name} keeps {flags}, loop keeps {expected}")
+                    sys.exit(1)
+
+    calls = 2 * len(corpus)
+    print(json.dumps({
+        'sets': len(corpus),
+        'boxes': int(sum(len(d) for d in corpus)),
+        'mismatches': 0,
+        'mean_ms': {name: round(total / calls * 1000, 4) for name, total in seconds.items()},
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Compares the latency of the detector backends on the same frames.
+
+$ python3 -m benchmarks.detectors --video approach.avi --backends tflite opencv
+"""
+import argparse
+import json
+import numpy as np
+import cv2
+
+from detector import make_detector
+from landing import ASSETS
+
+
+def read_frames(path, limit):
+    capture = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < limit:
+        return_value, frame = capture.read()
+        if not return_value:
+            break
+        frames.append(frame)
+    capture.release()
+
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--video', required=True)
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--batch', type=int, default=1)
+    parser.add_argument('--backends', nargs='+', default=list(ASSETS.MODELS))
+    args = parser.parse_args()
+
+    frames = read_frames(args.video, args.frames)
+    report = {}
+    for backend in args.backends:
+        detector = make_detector(backend, **ASSETS.MODELS[backend])
+        detector.detect(frames[0])  # warm up, the first invoke allocates
+        detector.latency.clear()
+
+        found = 0
+        for i in range(0, len(frames), args.batch):
+            found += sum(len(d) > 0 for d in detector.detect_batch(frames[i:i + args.batch]))
+
+        latency = np.array(detector.latency) * 1000
+        report[backend] = {
+            'frames': len(frames),
+            'batch': args.batch,
+            'detected': int(found),
+            'p50_ms': float(np.percentile(latency, 50)),
+            'p95_ms': float(np.percentile(latency, 95)),
+            'fps': float(1000 / latency.mean()),
+        }
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Per-frame cost of the landing estimate with several pads in view, the
+target pad tracked last. `each` locates and decodes every track on its own
+(what extending the single pad estimate to all tracks would cost),
+`batched` is landing's estimate. Both run with a cold decoder cache, as on
+the frames new pads show up in, and with a warm one, as while landing.
+
+$ python3 -m benchmarks.multi_pad --pads 1 2 4 8
+"""
+import argparse
+import json
+import time
+import numpy as np
+
+import landing
+
+from benchmarks.synthetic import render_pads, pad_box
+from camera import CameraModel
+from utils.helpers import arr_to_bbox
+from utils.vision import FingerprintDecoder, unpack_scene
+
+
+COARSE_SIZE = 160   # as in landing
+estimate_local_position = vars(landing)['__estimate_local_position']
+
+
+def hub(n, frame_shape=(480, 640)):
+    """ n pads in a grid, pad k carries the markers 4k+10 .. 4k+13 """
+    h, w = frame_shape
+    columns = int(np.ceil(np.sqrt(n)))
+    rows = int(np.ceil(n / columns))
+    side = int(min(w / columns, h / rows) * 0.6)
+    pads = []
+    for k in range(n):
+        center = ((k % columns + 0.5) * w / columns, (k // columns + 0.5) * h / rows)
+        pads.append((side, 5. * k, center, tuple(range(4 * k + 10, 4 * k + 14))))
+
+    frame, corners = render_pads(frame_shape, pads)
+    tracks = np.array([[*pad_box(c, frame.shape), k + 1, 1, 0] for k, c in enumerate(corners)], dtype=np.uint16)
+
+    return frame, tracks, [pad[3] for pad in pads]
+
+
+def estimate_each(frame, tracks, camera, decoder, markers):
+    for track in tracks:
+        box = camera.undistort_box(track)
+        roi_image = camera.undistort_roi(frame, box)
+        _, roi, dim0, center = unpack_scene(roi_image, arr_to_bbox((0, 0, box[2] - box[0], box[3] - box[1])),
+                                            coarse_size=COARSE_SIZE)
+        if roi is None:
+            continue
+
+        ids = decoder.decode(roi, track_id=int(track[4]), dim=dim0, center=(box[0] + center[0], box[1] + center[1]))
+        if len(ids) == 4 and sorted(np.ravel(ids).tolist()) == sorted(markers):
+            return int(track[4])
+
+    return None
+
+
+def measure(fn, repeats):
+    times, result = [], None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+
+    return round(float(np.median(times)) * 1000, 3), result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pads', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--repeats', type=int, default=50)
+    args = parser.parse_args()
+
+    camera = CameraModel.from_calib()
+    report = []
+    for n in args.pads:
+        frame, tracks, markers = hub(n)
+        target, want = markers[-1], int(tracks[-1][4])
+
+        # the decoder forgets every track before a cold call
+        decoder = FingerprintDecoder()
+        each_cold_ms, each_cold = measure(lambda: (decoder.forget(set()),
+                                                   estimate_each(frame, tracks, camera, decoder, target))[1],
+                                          args.repeats)
+        each_warm_ms, each_warm = measure(lambda: estimate_each(frame, tracks, camera, decoder, target), args.repeats)
+
+        decoder = FingerprintDecoder()
+        batched_cold_ms, batched_cold = measure(lambda: (decoder.forget(set()),
+                                                         estimate_local_position(frame, tracks, camera, decoder,
+                                                                                 target))[1], args.repeats)
+        batched_warm_ms, batched_warm = measure(lambda: estimate_local_position(frame, tracks, camera, decoder,
+                                                                                target), args.repeats)
+
+        report.append({
+            'pads': n,
+            'each_cold_ms': each_cold_ms,
+            'batched_cold_ms': batched_cold_ms,
+            'each_warm_ms': each_warm_ms,
+            'batched_warm_ms': batched_warm_ms,
+            'found': [each_cold == want, batched_cold[2] == want, each_warm == want, batched_warm[2] == want],
+        })
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Latency of unpack_scene per ROI size, full resolution against coarse-to-fine,
+and the corner error of both paths against the rendered pad corners.
+Corners more than MISS_PX off count as a miss instead of an error.
+
+$ python3 -m benchmarks.scene --coarse-size 160
+"""
+import argparse
+import json
+import time
+import numpy as np
+import cv2
+
+from benchmarks.synthetic import render_scene, pad_box
+from utils.vision import find_base, unpack_scene
+
+
+MISS_PX = 10.
+
+def corner_error(corners, truth):
+    distances = np.linalg.norm(corners[:, None, :] - truth[None, :, :], axis=2)
+    return float(distances.min(axis=1).max())
+
+
+def measure(frame, box, coarse_size, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        unpack_scene(frame, box, coarse_size=coarse_size)
+
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--coarse-size', type=int, default=160)
+    parser.add_argument('--sides', type=int, nargs='+', default=[80, 120, 180, 240, 320, 400])
+    parser.add_argument('--angles', type=float, nargs='+', default=[0, 5, 10, 15, 20])
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+
+    report = []
+    for side in args.sides:
+        full_ms, coarse_ms, rois = [], [], []
+        errors = {'full': [], 'coarse': []}
+        misses = {'full': 0, 'coarse': 0}
+        for angle in args.angles:
+            frame, truth, _ = render_scene(side=side, angle=angle)
+            box = pad_box(truth, frame.shape)
+            gray = cv2.cvtColor(frame[box[1]:box[3], box[0]:box[2]], cv2.COLOR_BGR2GRAY)
+            truth = truth - np.float32(box[:2])
+
+            rois.append(max(gray.shape))
+            for path, coarse_size in (('full', None), ('coarse', args.coarse_size)):
+                _, corners = find_base(gray, coarse_size)
+                error = corner_error(corners, truth) if corners is not None else np.inf
+                if error > MISS_PX:
+                    misses[path] += 1
+                else:
+                    errors[path].append(error)
+
+            full_ms.append(measure(frame, box, None, args.repeats))
+            coarse_ms.append(measure(frame, box, args.coarse_size, args.repeats))
+
+        report.append({
+            'side': side,
+            'roi': int(np.median(rois)),
+            'full_ms': round(float(np.median(full_ms)), 3),
+            'coarse_ms': round(float(np.median(coarse_ms)), 3),
+            'full_max_err_px': round(max(errors['full'], default=np.nan), 2),
+            'coarse_max_err_px': round(max(errors['coarse'], default=np.nan), 2),
+            'full_misses': misses['full'],
+            'coarse_misses': misses['coarse'],
+        })
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
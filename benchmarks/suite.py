@@ -0,0 +1,199 @@
+"""
+Latency of the vision and tracking stages of the landing loop on synthetic
+pad scenes (sizes x rotations x blur x noise), no camera or TPU needed.
+
+Every stage reports p50 / p95 / p99 / mean latency in ms and throughput in
+calls per second as JSON. Keep the output of a commit and pass it as
+--baseline to a later run: stages whose p50 grew by more than --tolerance
+are listed and the run exits with 1.
+
+$ python3 -m benchmarks.suite --output bench.json
+$ python3 -m benchmarks.suite --baseline bench.json
+"""
+import argparse
+import itertools
+import json
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+import cv2
+
+import landing
+
+from camera import CameraModel
+from benchmarks.check_suppression import track_set
+from benchmarks.synthetic import render_scene, pad_box
+from motion import Tracker
+from utils import kernels
+from utils.helpers import arr_to_bbox
+from utils.tracking import associate
+from utils.vision import FingerprintDecoder, unpack_fingerprint, unpack_scene
+
+
+COARSE_SIZE = 160   # as in landing
+estimate_local_position = vars(landing)['__estimate_local_position']
+
+
+def scenes(args):
+    rng = np.random.default_rng(args.seed)
+    for side, angle, blur, noise in itertools.product(args.sides, args.angles, args.blur, args.noise):
+        frame, corners, _ = render_scene(side=side, angle=angle, blur=blur, noise=noise, rng=rng)
+        yield frame, pad_box(corners, frame.shape)
+
+
+def moving_boxes(rng, n, frames):
+    """ n pads drifting over a 320x320 frame, one (n, 4) array of noisy boxes per frame """
+    corners = rng.uniform(20, 240, (n, 2))
+    velocity = rng.normal(0, 2, (n, 2))
+    sizes = rng.uniform(30, 60, (n, 2))
+    for _ in range(frames):
+        corners = np.clip(corners + velocity, 0, 260)
+        jitter = rng.normal(0, 1, (n, 2))
+        yield np.hstack((corners + jitter, corners + jitter + sizes))
+
+
+def percentiles(samples):
+    ms = np.asarray(samples) * 1000
+    return {
+        'calls': len(ms),
+        'p50_ms': round(float(np.percentile(ms, 50)), 4),
+        'p95_ms': round(float(np.percentile(ms, 95)), 4),
+        'p99_ms': round(float(np.percentile(ms, 99)), 4),
+        'mean_ms': round(float(ms.mean()), 4),
+        'throughput_hz': round(float(1000 / ms.mean()), 1),
+    }
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+
+    return result, time.perf_counter() - start
+
+
+def bench_vision(args):
+    camera = CameraModel.from_calib()
+    decoder = FingerprintDecoder()
+    samples = {'unpack_scene': [], 'unpack_fingerprint': [], 'estimate': [], 'estimate_cached': []}
+    found = {'unpack_scene': 0, 'unpack_fingerprint': 0, 'estimate': 0, 'estimate_cached': 0}
+
+    for frame, box in scenes(args):
+        track = np.array([[*box, 1, 1, 0]], dtype=np.uint16)  # rows of Tracker.update
+        for _ in range(args.repeats):
+            (_, subject, _, _), elapsed = timed(unpack_scene, frame, arr_to_bbox(box), False, COARSE_SIZE)
+            samples['unpack_scene'].append(elapsed)
+            found['unpack_scene'] += subject is not None
+
+            if subject is not None:
+                ids, elapsed = timed(unpack_fingerprint, subject)
+                samples['unpack_fingerprint'].append(elapsed)
+                found['unpack_fingerprint'] += len(ids) == 4
+
+            (ratio, _, _), elapsed = timed(estimate_local_position, frame, track, camera)
+            samples['estimate'].append(elapsed)
+            found['estimate'] += ratio is not None
+
+            # the same track in every frame, decoded IDs come from the cache
+            (ratio, _, _), elapsed = timed(estimate_local_position, frame, track, camera, decoder)
+            samples['estimate_cached'].append(elapsed)
+            found['estimate_cached'] += ratio is not None
+        decoder.forget(set())
+
+    return {name: {**percentiles(times), 'success': round(found[name] / max(len(times), 1), 3)}
+            for name, times in samples.items() if len(times) > 0}
+
+
+def bench_tracking(args):
+    rng = np.random.default_rng(args.seed)
+    samples = {'associate': [], 'tracker_update': [], 'hide_boxes': []}
+
+    for _ in range(args.frames):
+        trackers = np.hstack((rng.uniform(0, 280, (args.boxes, 2)), np.zeros((args.boxes, 3))))
+        trackers[:, 2:4] = trackers[:, :2] + rng.uniform(20, 60, (args.boxes, 2))
+        detections = trackers[rng.permutation(args.boxes)] + np.hstack((rng.normal(0, 2, (args.boxes, 4)),
+                                                                       np.zeros((args.boxes, 1))))
+        samples['associate'].append(timed(associate, detections, trackers)[1])
+
+        suppressed = track_set(rng, args.boxes)
+        samples['hide_boxes'].append(timed(Tracker.hide_boxes, suppressed.astype(np.float64), True)[1])
+
+    tracker = Tracker(shape=(320, 320, 3), min_hits=0, num_classes=1, interval=3)
+    labels = np.zeros(args.boxes, dtype=np.uint8)
+    for i, boxes in enumerate(moving_boxes(rng, args.boxes, args.frames)):
+        active = i % 3 == 0
+        if active:
+            samples['tracker_update'].append(timed(tracker.update, boxes, labels, True)[1])
+        else:
+            samples['tracker_update'].append(timed(tracker.update, np.array([]), np.array([]), False)[1])
+
+    return {name: percentiles(times) for name, times in samples.items()}
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'numba': kernels.njit is not None,
+    }
+
+
+def regressions(report, baseline, tolerance):
+    slower = []
+    for name, stats in report['stages'].items():
+        before = baseline.get('stages', {}).get(name)
+        if before and stats['p50_ms'] > before['p50_ms'] * (1. + tolerance):
+            slower.append(f"{name}: p50 {before['p50_ms']}ms -> {stats['p50_ms']}ms")
+
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sides', type=int, nargs='+', default=[100, 180, 260])
+    parser.add_argument('--angles', type=float, nargs='+', default=[0, 10, 20])
+    parser.add_argument('--blur', type=float, nargs='+', default=[0, 1.5], help='gaussian sigma in px')
+    parser.add_argument('--noise', type=float, nargs='+', default=[0, 8], help='gaussian sigma in gray levels')
+    parser.add_argument('--repeats', type=int, default=5, help='calls per scene')
+    parser.add_argument('--boxes', type=int, default=16, help='boxes per frame of the tracking stages')
+    parser.add_argument('--frames', type=int, default=500, help='frames of the tracking stages')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the report to this file')
+    parser.add_argument('--baseline', help='report of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p50 slowdown against the baseline')
+    args = parser.parse_args()
+
+    report = {
+        'environment': environment(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline', 'tolerance')},
+        'stages': {**bench_vision(args), **bench_tracking(args)},
+    }
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(report, json.load(f), args.tolerance)
+        for line in slower:
+            print(f"regression: {line}", file=sys.stderr)
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Synthetic camera frames of a landing pad: four ArUco 6x6 markers on a square
+white base, seen from straight above on a darker ground, optionally blurred
+and noisy like a moving camera.
+"""
+import numpy as np
+import cv2
+
+
+MARKER_IDS = (3, 4, 5, 6)
+
+
+def draw_pad(side, marker_ids=MARKER_IDS):
+    """ Front view of the pad, `side` pixels wide """
+    dictionary = cv2.aruco.Dictionary_get(cv2.aruco.DICT_6X6_250)
+    pad = np.full((side, side), 255, np.uint8)
+
+    # 2x2 markers with a white quiet zone around each of them
+    cell = side // 2
+    marker = int(cell * 0.7)
+    offset = (cell - marker) // 2
+    for i, marker_id in enumerate(marker_ids[:4]):
+        x0 = (i % 2) * cell + offset
+        y0 = (i // 2) * cell + offset
+        pad[y0:y0 + marker, x0:x0 + marker] = cv2.aruco.drawMarker(dictionary, marker_id, marker)
+
+    return pad
+
+
+def degrade(gray, blur=0., noise=0., rng=None):
+    """ Gaussian blur of `blur` px sigma and additive noise of `noise` gray levels, in place """
+    if blur > 0:
+        cv2.GaussianBlur(gray, (0, 0), blur, dst=gray)
+    if noise > 0:
+        rng = rng if rng is not None else np.random.default_rng(0)
+        noisy = gray + rng.normal(0., noise, gray.shape)
+        np.clip(noisy, 0, 255, out=noisy)
+        gray[:] = noisy
+
+    return gray
+
+
+def place_pad(frame, side, angle=0., center=None, marker_ids=MARKER_IDS):
+    """ Draws the pad into the gray `frame` in place, returns its corners [tl, bl, br, tr] """
+    h, w = frame.shape[:2]
+    if center is None:
+        center = (w / 2., h / 2.)
+
+    pad = draw_pad(side, marker_ids)
+    rotation = cv2.getRotationMatrix2D((side / 2., side / 2.), angle, 1.)
+    rotation[0, 2] += center[0] - side / 2.
+    rotation[1, 2] += center[1] - side / 2.
+
+    cv2.warpAffine(pad, rotation, (w, h), dst=frame, flags=cv2.INTER_LINEAR,
+                   borderMode=cv2.BORDER_TRANSPARENT)
+
+    corners = np.float32([[0, 0], [0, side], [side, side], [side, 0]])
+    return cv2.transform(corners.reshape(-1, 1, 2), rotation).reshape(-1, 2)
+
+
+def render_scene(frame_shape=(480, 640), side=200, angle=0., center=None,
+                 ground=90, marker_ids=MARKER_IDS, blur=0., noise=0., rng=None):
+    """ Returns a BGR frame, the pad corners [tl, bl, br, tr] and its bounding box
+
+    `angle` rotates the pad in degrees around `center` (defaults to the
+    frame center), `blur` and `noise` are applied by `degrade`.
+    """
+    frame = np.full(frame_shape[:2], ground, np.uint8)
+    corners = place_pad(frame, side, angle, center, marker_ids)
+    degrade(frame, blur, noise, rng)
+
+    x1, y1 = np.floor(corners.min(axis=0)).astype(int)
+    x2, y2 = np.ceil(corners.max(axis=0)).astype(int)
+
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR), corners, (x1, y1, x2, y2)
+
+
+def render_pads(frame_shape, pads, ground=90, blur=0., noise=0., rng=None):
+    """ A BGR frame with several pads, `pads` are (side, angle, center, marker_ids).
+
+    Returns the frame and the corners of each pad.
+    """
+    frame = np.full(frame_shape[:2], ground, np.uint8)
+    corners = [place_pad(frame, *pad) for pad in pads]
+    degrade(frame, blur, noise, rng)
+
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR), corners
+
+
+def pad_box(corners, frame_shape, margin=0.1):
+    """ Detector-like box around the pad with `margin` of its size on each side """
+    h, w = frame_shape[:2]
+    lo, hi = corners.min(axis=0), corners.max(axis=0)
+    pad = (hi - lo) * margin
+    x1, y1 = np.maximum(lo - pad, 0).astype(int)
+    x2, y2 = np.minimum(hi + pad, (w - 1, h - 1)).astype(int)
+
+    return (x1, y1, x2, y2)
@@ -0,0 +1,54 @@
+"""
+Memory per track of motion.Tracker: right after the tracks are created and
+after they coasted through an occlusion (frames without detections, during
+which the tracks are kept alive).
+
+$ python3 -m benchmarks.track_memory
+"""
+import argparse
+import json
+import tracemalloc
+import numpy as np
+
+from motion import Tracker
+
+
+def detections(rng, n):
+    corners = rng.uniform(0, 250, (n, 2))
+    return np.hstack((corners, corners + rng.uniform(30, 60, (n, 2)))), np.zeros(n, dtype=np.uint8)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tracks', type=int, default=64)
+    parser.add_argument('--frames', type=int, nargs='+', default=[100, 1000, 10000])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    dets, labels = detections(rng, args.tracks)
+    Tracker((320, 320, 3)).update(dets, labels)  # imports and kernels outside the measurement
+
+    tracemalloc.start()
+    baseline = tracemalloc.take_snapshot()
+    tracker = Tracker((320, 320, 3))
+    tracker.update(dets, labels)
+    tracks = len(tracker.trackers)
+
+    def per_track():
+        stats = tracemalloc.take_snapshot().compare_to(baseline, 'filename')
+        return round(sum(stat.size_diff for stat in stats) / tracks)
+
+    report = {'tracks': tracks, 'bytes_per_track': {'created': per_track()}}
+    coasted = 0
+    for frames in sorted(args.frames):
+        for _ in range(frames - coasted):
+            tracker.update(np.array([]), np.array([]), active=False)
+        coasted = frames
+        report['bytes_per_track'][f'coasted_{frames}'] = per_track()
+    tracemalloc.stop()
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
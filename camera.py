@@ -0,0 +1,139 @@
+import logging
+import os
+import threading
+import numpy as np
+import cv2
+
+from utils.helpers import CALIB, calculate_focal_length
+
+
+class CameraModel(object):
+    """ Intrinsics and lens distortion of the landing camera.
+
+    Loaded once from an OpenCV calibration file (camera_matrix,
+    distortion_coefficients, image_width, image_height - what
+    `cv2.calibrateCamera` based tools write through cv2.FileStorage). The
+    undistortion maps for the whole frame are computed once as well, but
+    only the tracked ROI is remapped per frame, into a buffer that is reused
+    by each estimation thread.
+
+    Points and boxes returned by `undistort_box` and the principal point
+    are in the undistorted image, whose intrinsics are those of the camera.
+    """
+
+    def __init__(self, camera_matrix, dist_coeffs, size):
+        self.camera_matrix = np.asarray(camera_matrix, dtype=np.float64).reshape(3, 3)
+        self.dist_coeffs = np.asarray(dist_coeffs, dtype=np.float64).reshape(-1)
+        self.size = (int(size[0]), int(size[1]))   # width, height
+        self.distorted = bool(np.any(self.dist_coeffs != 0.))
+
+        self.__maps = None
+        self.__buffers = threading.local()
+
+    @classmethod
+    def from_file(cls, path):
+        storage = cv2.FileStorage(path, cv2.FILE_STORAGE_READ)
+        try:
+            camera_matrix = storage.getNode('camera_matrix').mat()
+            dist_coeffs = storage.getNode('distortion_coefficients').mat()
+            size = (storage.getNode('image_width').real(), storage.getNode('image_height').real())
+        finally:
+            storage.release()
+
+        if camera_matrix is None:
+            raise ValueError(f"no camera_matrix in {path}")
+
+        return cls(camera_matrix, dist_coeffs if dist_coeffs is not None else np.zeros(5), size)
+
+    @classmethod
+    def from_calib(cls, size=(640, 480)):
+        """ Pinhole model without distortion from the CALIB reference measurement """
+        focal_length = calculate_focal_length(CALIB.REAL_DISTANCE, CALIB.REAL_WIDTH, CALIB.REFERENCE_WIDTH)
+        camera_matrix = [[focal_length, 0., size[0] / 2.],
+                         [0., focal_length, size[1] / 2.],
+                         [0., 0., 1.]]
+
+        return cls(camera_matrix, np.zeros(5), size)
+
+    @classmethod
+    def load(cls, path, size=(640, 480)):
+        """ The calibration in `path`, or the CALIB model if there is none """
+        if path and os.path.exists(path):
+            camera = cls.from_file(path)
+            logging.info(f"camera: {path}, f={camera.focal_length:.1f}px, "
+                         f"c=({camera.principal_point[0]:.1f}, {camera.principal_point[1]:.1f})")
+            return camera
+
+        logging.warning(f"camera: no calibration at {path}, using CALIB without undistortion")
+        return cls.from_calib(size)
+
+    def save(self, path):
+        storage = cv2.FileStorage(path, cv2.FILE_STORAGE_WRITE)
+        storage.write('image_width', self.size[0])
+        storage.write('image_height', self.size[1])
+        storage.write('camera_matrix', self.camera_matrix)
+        storage.write('distortion_coefficients', self.dist_coeffs.reshape(1, -1))
+        storage.release()
+
+    @property
+    def focal_length(self):
+        return float(self.camera_matrix[0, 0])
+
+    @property
+    def principal_point(self):
+        return (float(self.camera_matrix[0, 2]), float(self.camera_matrix[1, 2]))
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    def maps(self):
+        """ Fixed point maps from undistorted to distorted pixels of the whole frame """
+        if self.__maps is None:
+            self.__maps = cv2.initUndistortRectifyMap(self.camera_matrix, self.dist_coeffs, None,
+                                                      self.camera_matrix, self.size, cv2.CV_16SC2)
+        return self.__maps
+
+    def undistort_box(self, box, margin=0.05):
+        """ Integer box in the undistorted frame around the distorted `box` (x1, y1, x2, y2) """
+        x1, y1, x2, y2 = [float(v) for v in box[:4]]
+        if not self.distorted:
+            points = np.float64([[x1, y1], [x2, y2]])
+        else:
+            # corners and edge midpoints, lines bend under distortion
+            xs, ys = (x1, (x1 + x2) / 2., x2), (y1, (y1 + y2) / 2., y2)
+            points = np.float64([[x, y] for x in xs for y in ys]).reshape(-1, 1, 2)
+            points = cv2.undistortPoints(points, self.camera_matrix, self.dist_coeffs,
+                                         P=self.camera_matrix).reshape(-1, 2)
+
+        lo, hi = points.min(axis=0), points.max(axis=0)
+        pad = (hi - lo) * margin if self.distorted else 0.
+        x1, y1 = np.maximum(np.floor(lo - pad), 0).astype(int)
+        x2, y2 = np.minimum(np.ceil(hi + pad), self.size).astype(int)
+
+        return (int(x1), int(y1), int(x2), int(y2))
+
+    def undistort_roi(self, image, box):
+        """ The undistorted pixels of `box` (in undistorted frame coordinates, see undistort_box).
+
+        The result is a view into a buffer owned by the calling thread, valid
+        until its next call.
+        """
+        x1, y1, x2, y2 = box
+        if not self.distorted:
+            return image[y1:y2, x1:x2]
+
+        map1, map2 = self.maps()
+        buffer = getattr(self.__buffers, 'image', None)
+        if buffer is None or buffer.shape[2:] != image.shape[2:] or buffer.dtype != image.dtype:
+            buffer = np.empty((self.size[1], self.size[0]) + image.shape[2:], dtype=image.dtype)
+            self.__buffers.image = buffer
+
+        roi = buffer[:y2 - y1, :x2 - x1]
+        cv2.remap(image, map1[y1:y2, x1:x2], map2[y1:y2, x1:x2], cv2.INTER_LINEAR, dst=roi)
+
+        return roi
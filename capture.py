@@ -0,0 +1,117 @@
+import threading
+import asyncio
+import logging
+import time
+import cv2
+
+from collections import deque
+
+
+class Frame(object):
+    __slots__ = ('id', 'timestamp', 'image')
+
+    def __init__(self, frame_id, timestamp, image):
+        self.id = frame_id
+        self.timestamp = timestamp  # time.monotonic() right after the grab
+        self.image = image
+
+    def age(self, now=None):
+        return (time.monotonic() if now is None else now) - self.timestamp
+
+
+class FrameGrabber(object):
+    """ Reads frames on a dedicated thread into a small ring buffer.
+
+    OpenCV keeps its own queue of decoded frames, so calling `read()` from the
+    landing loop both blocks the event loop and hands out frames that are
+    already several hundred ms old. The grabber drains the device as fast as
+    it delivers, keeps only the newest `depth` frames and lets the consumer
+    await the latest one. Frames that are pushed out of the ring or skipped
+    by `latest()` are counted in `dropped`.
+    """
+
+    def __init__(self, channel=0, depth=2):
+        self.channel = channel
+        self.depth = depth
+        self.dropped = 0
+        self.grabbed = 0
+        self.last_age = None
+
+        self.__buffer = deque(maxlen=depth)
+        self.__lock = threading.Lock()
+        self.__thread = None
+        self.__running = False
+        self.__capture = None
+        self.__loop = None
+        self.__event = None
+
+    def start(self):
+        self.__loop = asyncio.get_running_loop()
+        self.__event = asyncio.Event()
+        self.__capture = cv2.VideoCapture(self.channel)
+        # keep the driver side queue as short as the backend allows
+        self.__capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.__running = self.__capture.isOpened()
+        self.__thread = threading.Thread(target=self.__grab, name='frame-grabber', daemon=True)
+        self.__thread.start()
+
+        return self
+
+    def stop(self):
+        # the capture is released by the thread once it left read()
+        self.__running = False
+        if self.__thread is not None:
+            self.__thread.join(timeout=1.0)
+            if self.__thread.is_alive():
+                logging.warning("frame-grabber: still reading, the capture is released when it returns")
+
+    def is_running(self):
+        return self.__running or len(self.__buffer) > 0
+
+    def __grab(self):
+        while self.__running:
+            return_value, image = self.__capture.read()
+            timestamp = time.monotonic()
+
+            if not return_value:
+                logging.warning("frame-grabber: capture returned no frame, stopping")
+                self.__running = False
+                break
+
+            with self.__lock:
+                if len(self.__buffer) == self.__buffer.maxlen:
+                    self.dropped += 1
+                self.__buffer.append(Frame(self.grabbed, timestamp, image))
+                self.grabbed += 1
+
+            self.__loop.call_soon_threadsafe(self.__event.set)
+
+        self.__capture.release()
+        # wake up a consumer waiting on a dead stream
+        self.__loop.call_soon_threadsafe(self.__event.set)
+
+    def latest_nowait(self):
+        """ Returns the newest frame (or None) and discards everything older """
+        with self.__lock:
+            if len(self.__buffer) < 1:
+                return None
+
+            frame = self.__buffer.pop()
+            self.dropped += len(self.__buffer)
+            self.__buffer.clear()
+
+        self.last_age = frame.age()
+        return frame
+
+    async def latest(self):
+        """ Awaits a frame newer than the last one handed out; None once the stream ended """
+        while True:
+            self.__event.clear()
+            frame = self.latest_nowait()
+
+            if frame is not None:
+                return frame
+            if not self.__running:
+                return None
+
+            await self.__event.wait()
@@ -0,0 +1,214 @@
+import logging
+import numpy as np
+import time
+import cv2
+
+from abc import ABC, abstractmethod
+from collections import deque
+from utils.tensor import InputTensor
+
+
+def read_labels(path):
+    """ Reads a label file with either `<id> <label>` or one label per line """
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = [line.strip() for line in f.readlines() if line.strip()]
+
+    labels = {}
+    for row, line in enumerate(lines):
+        pair = line.split(maxsplit=1)
+        if len(pair) == 2 and pair[0].isdigit():
+            labels[int(pair[0])] = pair[1]
+        else:
+            labels[row] = line
+
+    return labels
+
+
+def crop_around(box, frame_shape, input_size, margin=0.75, max_zoom=4.):
+    """ Square window (x0, y0, x1, y1) around `box` to run the detector on.
+
+    The window leaves `margin` box sizes of room on every side for the pad to
+    move and is never smaller than `input_size / max_zoom`. Also returns how
+    much larger the pad appears to the model compared to a full frame run.
+    """
+    h, w = frame_shape[:2]
+    side = max(box[2] - box[0], box[3] - box[1]) * (1. + 2. * margin)
+    side = int(min(max(side, min(input_size) / max_zoom), h, w))
+    x0 = int(np.clip((box[0] + box[2] - side) / 2., 0, w - side))
+    y0 = int(np.clip((box[1] + box[3] - side) / 2., 0, h - side))
+
+    full_scale = min(input_size[0] / w, input_size[1] / h)
+    crop_scale = min(input_size) / side
+
+    return (x0, y0, x0 + side, y0 + side), crop_scale / full_scale
+
+
+class Detector(ABC):
+    """ Common interface of the detection backends.
+
+    `detect` returns an (N, 6) array of [x1, y1, x2, y2, score, label] rows in
+    the coordinates of the image that was passed in, sorted by score.
+    `detect_batch` takes a list of frames or crops (of any size) and returns
+    one such array per image; backends that can only run one image per
+    invoke loop internally over `_detect`, the one method a backend must
+    implement. The time spent per image of the last calls is kept in
+    `latency`.
+
+    Images are passed in OpenCV's BGR order and every backend feeds them to
+    the model as such, unless `swap_rb` is set to convert them to RGB.
+    """
+
+    def __init__(self, model, threshold=0.8, swap_rb=False):
+        self.model = model
+        self.threshold = threshold
+        self.swap_rb = swap_rb
+        self.input_size = None  # (width, height) the images are resized to
+        self.latency = deque(maxlen=1000)
+
+    def detect(self, image):
+        return self.detect_batch([image])[0]
+
+    def detect_roi(self, image, window):
+        """ Runs on the `window` (see crop_around) of `image`, boxes are in `image` coordinates """
+        x0, y0, x1, y1 = window
+        detections = self.detect(image[y0:y1, x0:x1])
+        detections[:, [0, 2]] += x0
+        detections[:, [1, 3]] += y0
+
+        return detections
+
+    def detect_batch(self, images):
+        start = time.perf_counter()
+        results = [self._detect(image) for image in images]
+        self.latency.append((time.perf_counter() - start) / max(len(images), 1))
+
+        return results
+
+    @abstractmethod
+    def _detect(self, image):
+        """ Detections on a single image, as returned by `detect` """
+
+    def _filter(self, detections):
+        detections = detections[detections[:, 4] >= self.threshold]
+        return detections[np.argsort(-detections[:, 4], kind='stable')]
+
+
+class TfliteDetector(Detector):
+    """ SSD detector on the CPU through tflite-runtime (or full tensorflow) """
+
+    def __init__(self, model, threshold=0.8, swap_rb=False, num_threads=None):
+        super().__init__(model, threshold, swap_rb)
+        self.interpreter = self._make_interpreter(model, num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_tensor = InputTensor(self.interpreter, swap_rb=swap_rb)
+        self.input_size = (self.input_tensor.width, self.input_tensor.height)
+        self.__outputs = self.__output_indices()
+
+    def _make_interpreter(self, model, num_threads):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+
+        return Interpreter(model_path=model, num_threads=num_threads)
+
+    def __output_indices(self):
+        # tensor indices of boxes, class ids, scores and count; the post-process
+        # op orders its outputs differently in TF1 and TF2 exports, resolved
+        # as pycoral's detect.get_objects does
+        signatures = self.interpreter._get_full_signature_list()
+        if signatures:
+            if len(signatures) > 1:
+                raise ValueError(f"{self.model}: only models with one signature are supported")
+            outputs = signatures[next(iter(signatures))]['outputs']
+            return tuple(outputs[f'output_{i}'] for i in (3, 2, 1, 0))
+
+        details = self.interpreter.get_output_details()
+        if np.prod(details[3]['shape']) == 1:
+            return tuple(details[i]['index'] for i in (0, 1, 2, 3))
+        return tuple(details[i]['index'] for i in (1, 3, 0, 2))
+
+    def __output(self, i):
+        return self.interpreter.get_tensor(self.__outputs[i])[0]
+
+    def _detect(self, image):
+        scale = self.input_tensor.set(image)
+        self.interpreter.invoke()
+
+        # normalized [ymin, xmin, ymax, xmax], class ids, scores, count
+        count = int(self.__output(3))
+        boxes, class_ids, scores = (self.__output(0)[:count], self.__output(1)[:count],
+                                    self.__output(2)[:count])
+        sx = self.input_tensor.width / scale[0]
+        sy = self.input_tensor.height / scale[1]
+
+        return self._filter(np.column_stack((
+            boxes[:, 1] * sx, boxes[:, 0] * sy, boxes[:, 3] * sx, boxes[:, 2] * sy,
+            scores, class_ids)).astype(np.float64).reshape(-1, 6))
+
+
+class EdgeTpuDetector(TfliteDetector):
+    """ The same model compiled for the Coral Edge TPU """
+
+    def _make_interpreter(self, model, num_threads):
+        from pycoral.utils.edgetpu import make_interpreter
+
+        return make_interpreter(model)
+
+
+class OpenCvDetector(Detector):
+    """ Detector on OpenCV's DNN module, runs a whole batch in one forward pass.
+
+    Takes a frozen TensorFlow graph (`model`) and its text description
+    (`config`), the output is the usual [batch_id, class, score, x1, y1, x2, y2]
+    rows in normalized coordinates with class 0 being the background.
+    """
+
+    def __init__(self, model, config=None, threshold=0.8, swap_rb=False, size=(320, 320)):
+        super().__init__(model, threshold, swap_rb)
+        self.size = self.input_size = size
+        self.net = cv2.dnn.readNet(model, config) if config else cv2.dnn.readNet(model)
+
+    def __forward(self, images):
+        blob = cv2.dnn.blobFromImages(images, size=self.size, swapRB=self.swap_rb, crop=False)
+        self.net.setInput(blob)
+        outputs = self.net.forward().reshape(-1, 7)
+
+        results = []
+        for i, image in enumerate(images):
+            rows = outputs[outputs[:, 0] == i]
+            h, w = image.shape[:2]
+            results.append(self._filter(np.column_stack((
+                rows[:, 3] * w, rows[:, 4] * h, rows[:, 5] * w, rows[:, 6] * h,
+                rows[:, 2], rows[:, 1] - 1)).astype(np.float64).reshape(-1, 6)))
+
+        return results
+
+    def _detect(self, image):
+        return self.__forward([image])[0]
+
+    def detect_batch(self, images):
+        # one forward pass for the whole batch instead of one per image
+        if len(images) < 1:
+            return []
+
+        start = time.perf_counter()
+        results = self.__forward(images)
+        self.latency.append((time.perf_counter() - start) / len(images))
+
+        return results
+
+
+BACKENDS = {
+    'edgetpu': EdgeTpuDetector,
+    'tflite': TfliteDetector,
+    'opencv': OpenCvDetector,
+}
+
+
+def make_detector(backend, model, **kwargs):
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown detector backend '{backend}', expected one of {list(BACKENDS)}")
+
+    logging.info(f"detector: {backend} backend with {model}")
+    return BACKENDS[backend](model, **kwargs)
@@ -4,6 +4,7 @@ import logging
 from haversine import haversine
 
 from message_type import ToServer
+from preflight import PreflightError
 
 
 class Drone:
@@ -22,8 +23,8 @@ class Drone:
 		self.mav = mav
 
 	# return True if drone successfully landed on the pad; return False if landing failed (e.g. pad not found)
-	async def __try_landing(self):
-		await self.mav.land()
+	async def __try_landing(self, facility):
+		await self.mav.land(facility)
 		return True
 
 	def __handle_task_result(self, task):
@@ -43,7 +44,7 @@ class Drone:
 			logging.warning(f'{new.__name__} same as old state')
 			return False
 		if (
-			(new == self.state_idle and self.state not in [self.state_landing, self.state_return_landing, self.state_updating]) or
+			(new == self.state_idle and self.state not in [self.state_landing, self.state_return_landing, self.state_updating, self.state_en_route]) or
 			(new == self.state_updating and self.state not in [self.state_idle]) or
 			(new == self.state_en_route and self.state not in [self.state_updating]) or
 			(new == self.state_landing and self.state not in [self.state_en_route]) or
@@ -80,6 +81,7 @@ class Drone:
 	# disarm and wait
 	async def state_idle(self):
 		await self.mav.disarm()
+		await self.mav.set_telemetry_profile('idle')
 
 	# go en_route on self.new_mission or just stay idle if it's bullshit
 	async def state_updating(self):
@@ -94,12 +96,21 @@ class Drone:
 
 	# arm drone, fly self.current_mission and try landing when finished
 	async def state_en_route(self):
-		await self.mav.execute_mission(self.current_mission.get_items())
+		# the time to takeoff counts, the rates are not needed for the preflight
+		try:
+			await asyncio.gather(self.mav.set_telemetry_profile('mission'),
+								 self.mav.execute_mission(self.current_mission.get_items()))
+		except PreflightError as e:
+			# still on the ground, the server may send the mission again
+			logging.error(f'mission not started: {e}')
+			self.set_state(self.state_idle)
+			return
 		self.set_state(self.state_landing)
 
 	# attempt first landing and handle failure
 	async def state_landing(self):
-		if await self.__try_landing():
+		await self.mav.set_telemetry_profile('landing')
+		if await self.__try_landing(self.current_mission.goal):
 			logging.info(f'landed on {self.current_mission.goal.id}')
 			self.latest_facility = self.current_mission.goal
 			self.set_state(self.state_idle)
@@ -109,7 +120,8 @@ class Drone:
 
 	# attempt second landing and handle failure
 	async def state_return_landing(self):
-		if await self.__try_landing():
+		await self.mav.set_telemetry_profile('landing')
+		if await self.__try_landing(self.current_mission.start):
 			logging.info(f'landed on {self.current_mission.start.id}')
 			self.latest_facility = self.current_mission.start
 			self.set_state(self.state_idle)
@@ -125,11 +137,18 @@ class Drone:
 			logging.warning('not enough battery charge, performing emergency landing')
 			self.set_state(self.state_emergency_landing)
 		else:
-			await self.mav.execute_mission(self.current_mission.get_items(True, self.mav.pos))
+			await self.mav.set_telemetry_profile('mission')
+			try:
+				await self.mav.execute_mission(self.current_mission.get_items(True, self.mav.pos))
+			except PreflightError as e:
+				logging.error(f'return not started: {e}')
+				self.set_state(self.state_emergency_landing)
+				return
 			self.set_state(self.state_return_landing)
 
 	# fuck it, we landing
 	async def state_emergency_landing(self):
+		await self.mav.set_telemetry_profile('landing')
 		await self.mav.land()
 		self.set_state(self.state_crashed)
 
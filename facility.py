@@ -1,6 +1,11 @@
 # spot with a landing pad
 class Facility:
-    def __init__(self, facility_id, pos):
+    def __init__(self, facility_id, pos, markers=None):
         self.id = facility_id
         self.pos = pos
-        # stuff like the specific pattern on the landing pad can be added here
+        # ArUco IDs on its landing pad, None if unknown (any pad will do)
+        self.markers = tuple(markers) if markers is not None else None
+
+    @classmethod
+    def from_raw(cls, raw):
+        return cls(raw['id'], (raw['pos'][0], raw['pos'][1]), raw.get('markers'))
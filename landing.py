@@ -3,148 +3,289 @@ import numpy as np
 import asyncio
 import time
 import math
-import cv2
 
-from PIL import Image
 from PIL import ImageDraw
 
-from pycoral.adapters import common
-from pycoral.adapters import detect
-from pycoral.utils.dataset import read_label_file
-from pycoral.utils.edgetpu import make_interpreter
-
 from numpy.linalg import norm
+from functools import partial
 from motion import Tracker
+from capture import FrameGrabber
+from pipeline import Pipeline, Stage
+from detector import crop_around, make_detector, read_labels
+from scheduler import DetectionScheduler
+from setpoint import SetpointPublisher
+from recording import Recorder
+from camera import CameraModel
 
 from utils.drawing import draw_objects
-from utils.vision import unpack_fingerprint, unpack_scene
-from utils.helpers import CALIB, arr_to_bbox, calculate_distance, calculate_focal_length
+from utils.vision import FingerprintDecoder, unpack_fingerprints, unpack_scene
+from utils.helpers import CALIB, arr_to_bbox, calculate_distance
 
 
 class ASSETS:
     MODEL = './assets/ssdlite_mobiledet_landingpad_edgetpu.tflite'
     LFILE = './assets/labels.txt'
+    # OpenCV calibration file, see camera.CameraModel; without it CALIB is used
+    CALIBRATION = './assets/camera.yaml'
+    FRAME_SIZE = (640, 480)
+    # edgetpu | tflite | opencv, the latter two run without a Coral attached
+    BACKEND = 'edgetpu'
+    MODELS = {
+        'edgetpu': {'model': MODEL},
+        'tflite': {'model': './assets/ssdlite_mobiledet_landingpad.tflite'},
+        'opencv': {'model': './assets/ssdlite_mobiledet_landingpad.pb',
+                   'config': './assets/ssdlite_mobiledet_landingpad.pbtxt'},
+    }
+
+
+class CONTROL:
+    ALTITUDE = 3            # m above home of the correction setpoints, see MavBase.absolute_altitude
+    SETPOINT_RATE = 4.      # Hz
+    SETPOINT_MODE = 'position'  # position | velocity (offboard)
+    VELOCITY_GAIN = 0.5     # 1/s, m/s of velocity per m of offset
+    MAX_VELOCITY = 1.       # m/s
+
+
+class Job(object):
+    """ State of one frame on its way through the landing pipeline """
+    __slots__ = ('frame', 'active', 'window', 'zoom', 'outputs', 'detections', 'labels',
+                 'tracks', 'pad', 'ratio', 'local_position')
+
+    def __init__(self, frame, active, window=None, zoom=1.):
+        self.frame = frame
+        self.active = active
+        self.window, self.zoom = (window, zoom)
+        self.outputs = np.empty((0, 6))
+        self.detections, self.labels = (np.array([]), np.array([]))
+        self.tracks = None
+        self.pad = None     # objID of the track the estimate is made on
+        self.ratio, self.local_position = (None, None)
 
 
 def __setup_stream(channel):
-    # TODO: add picam bindings
-    return cv2.VideoCapture(channel)
+    return FrameGrabber(channel).start()
 
 
-def __load_interpreter():
-    interpreter = make_interpreter(ASSETS.MODEL)
-    interpreter.allocate_tensors()
+def __load_interpreter(backend=ASSETS.BACKEND):
+    return make_detector(backend, threshold=0.8, **ASSETS.MODELS[backend])
 
-    return interpreter
 
+def __is_target(fingerprint, markers):
+    # a full pad, and the one of the target facility if its markers are known
+    if len(fingerprint) != 4:
+        return False
 
-def __estimate_local_position(source_image, bbox, F):
-    root_point = (320, 240)
-    
-    if len(bbox) < 1:
-        return (None, None)
-    
-    source_image, roi, dim0, center_point = unpack_scene(source_image, arr_to_bbox(bbox[0]))
+    return markers is None or sorted(np.ravel(fingerprint).tolist()) == sorted(markers)
 
-    if roi is not None:
-        fingerprint = unpack_fingerprint(roi)
-        
-        if len(fingerprint) == 4:
-            ratio = math.hypot(root_point[0] - center_point[0],
-                               root_point[1] - center_point[1]) / dim0
-            
-            distance_y = calculate_distance(F, CALIB.REAL_WIDTH, dim0)
-            distance_x = (root_point[0] - center_point[0])
-            distance_x = distance_y * (distance_x / dim0)
-            distance_z = (root_point[1] - center_point[1])
-            distance_z = distance_y * (distance_z / dim0)
-
-            return (ratio, (distance_x, distance_y, distance_z))
+
+def __estimate_local_position(source_image, bbox, camera, decoder=None, markers=None):
+    root_point = camera.principal_point
+    F = camera.focal_length
     
-    return (None, None)
+    if len(bbox) < 1:
+        return (None, None, None)
+
+    # bbox: [x1, y1, x2, y2, objID, is_update, labelID] rows; the IDs of all
+    # pads are read in one pass (mostly from the decoder's cache), only the
+    # target pad is located
+    if decoder is not None:
+        fingerprints = decoder.decode_boxes(source_image, bbox[:, :4], [int(t[4]) for t in bbox], coarse_size=120)
+    else:
+        fingerprints = unpack_fingerprints(source_image, bbox[:, :4], coarse_size=120)
+
+    candidates = [t for t, fingerprint in zip(bbox, fingerprints) if __is_target(fingerprint, markers)]
+    if len(candidates) < 1:
+        return (None, None, None)
+    # several pads of the same facility: the closest one
+    target = max(candidates, key=lambda t: (int(t[2]) - int(t[0])) * (int(t[3]) - int(t[1])))
+
+    # only the tracked ROI is undistorted, positions below are in the undistorted frame
+    box = camera.undistort_box(target)
+    if box[2] <= box[0] or box[3] <= box[1]:
+        # off the frame, a cached fingerprint outlived the pad
+        return (None, None, None)
+    roi_image = camera.undistort_roi(source_image, box)
+
+    # find the pad on a 160px copy of large ROIs, refine its corners at full size
+    _, roi, dim0, center_point = unpack_scene(roi_image, arr_to_bbox((0, 0, box[2] - box[0], box[3] - box[1])),
+                                              coarse_size=160)
+
+    if roi is None:
+        return (None, None, None)
+
+    # unpack_scene finds the pad center in the ROI, the offset is to the principal point
+    center_point = (box[0] + center_point[0], box[1] + center_point[1])
+
+    ratio = math.hypot(root_point[0] - center_point[0],
+                       root_point[1] - center_point[1]) / dim0
+
+    distance_y = calculate_distance(F, CALIB.REAL_WIDTH, dim0)
+    distance_x = (root_point[0] - center_point[0])
+    distance_x = distance_y * (distance_x / dim0)
+    distance_z = (root_point[1] - center_point[1])
+    distance_z = distance_y * (distance_z / dim0)
+
+    return (ratio, (distance_x, distance_y, distance_z), int(target[4]))
         
 
-async def __prepare_landing(system, mav, x, z):
+def __prepare_landing(publisher, mav, x, z, timestamp):
     r_earth = 6371000.0     # in meters
-    
-    current_pos = mav.pos
+
+    # x, z is the offset from where the drone was when the frame was taken
+    current_pos = mav.position_at(timestamp)
+
+    if publisher.mode == 'velocity':
+        # less what the drone moved since
+        latest_pos = mav.pos
+        z -= (latest_pos[0] - current_pos[0]) * math.pi / 180 * r_earth
+        x -= (latest_pos[1] - current_pos[1]) * math.pi / 180 * r_earth * math.cos(current_pos[0] * math.pi / 180)
+
+        north = float(np.clip(z * CONTROL.VELOCITY_GAIN, -CONTROL.MAX_VELOCITY, CONTROL.MAX_VELOCITY))
+        east = float(np.clip(x * CONTROL.VELOCITY_GAIN, -CONTROL.MAX_VELOCITY, CONTROL.MAX_VELOCITY))
+        publisher.submit_velocity(north, east, 0.)
+        return
 
     new_latitude  = current_pos[0]  + (z / r_earth) * (180 / math.pi);
     new_longitude = current_pos[1] + (x / r_earth) * (180 / math.pi) / math.cos(current_pos[0] * math.pi/180);
 
-    await system.goto_location(new_latitude, new_longitude, 3, 0)
+    publisher.submit_position(new_latitude, new_longitude, mav.absolute_altitude(CONTROL.ALTITUDE), 0)
 
 
-async def __do_landing(system):
+async def __do_landing(system, publisher):
+    await publisher.stop()
     await system.action.land()
 
 
-async def do_landing(**kwagrs):
-    focal_length = calculate_focal_length(CALIB.REAL_DISTANCE, 
-                        CALIB.REAL_WIDTH, CALIB.REFERENCE_WIDTH)
-    labels = read_label_file(ASSETS.LFILE) if ASSETS.LFILE else {}
-    interpreter = __load_interpreter()
+def __infer(detector, job):
+    if not job.active:
+        return job
 
-    tracker = Tracker(shape=(320, 320, 3), min_hits=0, num_classes=len(labels),
-                      interval=3)
-    capture = cv2.VideoCapture(0)
-    frameid = 0
+    if job.window is not None:
+        outputs = detector.detect_roi(job.frame.image, job.window)
+    else:
+        outputs = detector.detect(job.frame.image)
 
-    while capture.isOpened():
-        return_value, frame = capture.read()
+    job.outputs = outputs
+    if len(outputs) > 0:
+        # every pad is tracked, the estimation picks the target among them
+        job.detections = outputs[:, :4]
+        job.labels = np.zeros(len(outputs), dtype=np.uint8)
 
-        if not return_value:
-            break
-        
-        x = Image.fromarray(frame)
-        _, scale = common.set_resized_input(interpreter, x.size, 
-                      lambda size: x.resize(size, Image.ANTIALIAS))
-
-        detections0, labels0, active = (None, None, None) 
-
-        if np.mod(frameid, 3) == 0:
-            interpreter.invoke()
-            outputs = detect.get_objects(interpreter, 0.8, scale)            
-            detections0 = (
-                np.array(
-                    [
-                        [
-                            outputs[0].bbox[0],
-                            outputs[0].bbox[1],
-                            outputs[0].bbox[2],
-                            outputs[0].bbox[3],
-                        ]
-                    ]
-                )
-                if len(outputs) > 0
-                else np.array([])
-            )                    
-            labels0 = np.array(['0']).astype(np.uint8) if len(outputs) > 0 else np.array([])
-            active = True
-        elif np.mod(frameid, 3) != 0:
-            detections0, labels0 = (np.array([]), np.array([]))
-            active = False
-        
-        tracks0 = tracker.update(detections0, labels0, active)    
+    return job
 
-        x = np.asarray(x)
-        ratio, local_position = __estimate_local_position(x, tracks0, focal_length)
 
-        if ratio is not None:
-            logging.info("local-position-estimation: SUCCESS")
-            logging.info(f"pos := <{local_position[0]}, {local_position[1]}, {local_position[2]}> [METRIC: CM]")
-            
-            await __prepare_landing(kwagrs["mavsdk_system"], kwagrs["mav"], local_position[0] / 10, local_position[2] / 10)
+def __track(tracker, scheduler, decoder, job):
+    job.tracks = tracker.update(job.detections, job.labels, job.active, zoom=job.zoom)
+    scheduler.observe_tracks(tracker)
+    decoder.forget({trk.id + 1 for trk in tracker.trackers})
 
-            if ratio < 0.16:
-                logging.info("drone overlaps with landing pad --> landing")
+    return job
 
-                await __do_landing(kwagrs["mavsdk_system"])
-                logging.info("drone landed")
-                break
-            
-        frameid += 1    
-    
+
+def __record(recorder, mav, job):
+    recorder.write(job.frame, job.active, job.outputs, job.tracks, mav.position_at(job.frame.timestamp))
+
+    return job
 
 
+def __estimate(camera, decoder, markers, job):
+    job.ratio, job.local_position, job.pad = __estimate_local_position(job.frame.image, job.tracks, camera,
+                                                                      decoder, markers)
+
+    return job
+
+
+async def do_landing(**kwagrs):
+    camera = kwagrs.get("camera") or CameraModel.load(ASSETS.CALIBRATION, ASSETS.FRAME_SIZE)
+    labels = read_labels(ASSETS.LFILE) if ASSETS.LFILE else {}
+    # a replay (see recording.py) brings its own detector and frame source
+    detector = kwagrs.get("detector") or __load_interpreter(kwagrs.get("backend", ASSETS.BACKEND))
+
+    # boxes are in frame coordinates, shape[0] bounds their width, shape[1] their height.
+    # min_size keeps the 12.8px smallest box the 320px shape gave, skip_ratio would scale it up
+    tracker = Tracker(shape=(camera.width, camera.height, 3), min_hits=0, num_classes=len(labels),
+                      interval=3, min_size=12.8)
+    scheduler = DetectionScheduler()
+    decoder = FingerprintDecoder()
+    # the facility to land on, any pad if it is not given or its markers are unknown
+    target = kwagrs.get("target")
+    markers = target.markers if target is not None else None
+    # detect on a magnified crop around a confidently tracked pad
+    roi_detection = kwagrs.get("roi", False)
+    capture = kwagrs["capture"].start() if "capture" in kwagrs else __setup_stream(kwagrs.get("channel", 0))
+    recorder = Recorder(kwagrs["record"]) if kwagrs.get("record") else None
+    publisher = SetpointPublisher(kwagrs["mavsdk_system"],
+                    rate=kwagrs.get("setpoint_rate", CONTROL.SETPOINT_RATE),
+                    mode=kwagrs.get("setpoint_mode", CONTROL.SETPOINT_MODE)).start()
+
+    # the frame is resized straight into the input tensor, so preprocessing
+    # belongs to the detector stage; detector and tracker have to see the
+    # frames in order, pose estimation may overlap with both
+    stages = [
+        Stage('infer', partial(__infer, detector)),
+        Stage('track', partial(__track, tracker, scheduler, decoder)),
+        Stage('estimate', partial(__estimate, camera, decoder, markers), workers=2),
+    ]
+    if recorder is not None:
+        stages.insert(2, Stage('record', partial(__record, recorder, kwagrs["mav"])))
+    pipeline = Pipeline(stages)
+    latest = -1
+    latency = []    # s from a frame's arrival to the decision made on it
+
+    async def source():
+        frame = await capture.latest()
+        if frame is None:
+            return None
+
+        active = scheduler.next()
+        focus = scheduler.focus
+        if active and roi_detection and focus is not None:
+            window, zoom = crop_around(focus, frame.image.shape, detector.input_size)
+            return Job(frame, active, window, zoom)
+
+        return Job(frame, active)
+
+    async def sink(job):
+        nonlocal latest
+
+        # estimation runs on several workers, don't act on an outdated frame
+        if job.frame.id < latest:
+            return False
+        latest = job.frame.id
+
+        logging.debug(f"frame {job.frame.id}: age {job.frame.age() * 1000:.1f}ms, {capture.dropped} dropped")
+        scheduler.observe_ratio(job.ratio, job.pad)
+
+        if job.ratio is not None:
+            local_position = job.local_position
+            logging.info("local-position-estimation: SUCCESS")
+            logging.info(f"pos := <{local_position[0]}, {local_position[1]}, {local_position[2]}> [METRIC: CM]")
 
+            __prepare_landing(publisher, kwagrs["mav"], local_position[0] / 100, local_position[2] / 100,
+                              job.frame.timestamp)
+        latency.append(job.frame.age())
+
+        if job.ratio is not None and job.ratio < 0.16:
+            logging.info("drone overlaps with landing pad --> landing")
+
+            await __do_landing(kwagrs["mavsdk_system"], publisher)
+            logging.info("drone landed")
+            return True
+
+        return False
+
+    try:
+        await pipeline.run(source, sink)
+    finally:
+        logging.info(f"frame-grabber: {capture.grabbed} frames grabbed, {capture.dropped} dropped")
+        logging.info(f"detection-scheduler: {scheduler.stats()}")
+        logging.info(f"fingerprint-decoder: {decoder.stats()}")
+        logging.info(f"setpoint-publisher: {publisher.stats()}")
+        await publisher.stop()
+        capture.stop()
+        pipeline.shutdown()
+        if recorder is not None:
+            recorder.close()
+
+    return {'latency': latency, 'grabber': {'grabbed': capture.grabbed, 'dropped': capture.dropped},
+            'scheduler': scheduler.stats(), 'decoder': decoder.stats(), 'publisher': publisher.stats()}
@@ -1,29 +1,83 @@
 import asyncio
+import hashlib
+import json
 import logging
+import time
 
 import mavsdk
 
 from mav_base import MavBase
+from preflight import Preflight, PreflightError
+from telemetry import Subscriptions
 #from landing import do_landing
 
 class Mav(MavBase):
-	def __init__(self):
+	# calibrations that succeeded, see init_connection
+	CALIBRATION_STATE = './calibration.json'
+	CALIBRATION_MAX_AGE = 7 * 24 * 3600 # s
+	# autopilot params a calibration writes, by prefix; if they changed, it is redone
+	CALIBRATION_PARAMS = {
+		'gyro': ('CAL_GYRO',),
+		'level': ('SENS_BOARD_X_OFF', 'SENS_BOARD_Y_OFF'),
+	}
+	# s per step of execute_mission before the mission starts
+	PREFLIGHT_TIMEOUTS = {'health': 120., 'params': 10., 'upload': 60., 'arm': 10., 'start': 10.}
+	# use mavlink instead of rc http://docs.px4.io/master/en/advanced_config/parameter_reference.html
+	PARAMS = {'COM_RC_IN_MODE': 2}
+
+	def __init__(self, recalibrate=False):
 		self.__mav = mavsdk.System()
 		super().__init__()
-	
-	async def __get_battery(self):
-		async for val in self.__mav.telemetry.battery():
-			logging.info(f"val: {val}")
-			self.battery = val.remaining_percent
-			logging.info(f"new battery: {self.battery}")
-
-	async def __get_pos(self):
-		async for val in self.__mav.telemetry.position():
-			logging.info(f"val: {val}")
-			self.pos = [val.latitude_deg, val.longitude_deg]
-			logging.info(f"new pos: {self.pos}")
+		# rates per flight phase, see telemetry.Subscriptions
+		self.subscriptions = Subscriptions(self.__mav, self.telemetry)
+		# calibrate even if the last calibration is still valid
+		self.recalibrate = recalibrate
+		self.startup = {} # s per phase of init_connection
+		# item keys of the plan on the autopilot, see execute_mission
+		self.__mission = None
+		self.__rtl_set = False
+		self.__upload_rate = 0. # s per item of the last upload
+		self.mission_stats = {'uploads': 0, 'skipped': 0, 'resumed': 0, 'upload_s': 0., 'saved_s': 0.}
+		self.preflight = {} # (start, end) of each step of the last preflight, takeoff in s
+
+	async def __read_params(self):
+		# all params in one request instead of one round trip each
+		params = await self.__mav.param.get_all_params()
+		return {**{p.name: p.value for p in params.int_params}, **{p.name: p.value for p in params.float_params}}
+
+	@staticmethod
+	def __calibration_params(name, params):
+		prefixes = Mav.CALIBRATION_PARAMS[name]
+		return {key: value for key, value in params.items() if key.startswith(prefixes)}
+
+	@staticmethod
+	def __load_calibrations():
+		try:
+			with open(Mav.CALIBRATION_STATE) as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return {}
+
+	@staticmethod
+	def __calibration_valid(name, state, params):
+		# wall clock, the state outlives reboots; a clock that went back invalidates it
+		entry = state.get(name)
+		if entry is None:
+			return False
+
+		age = time.time() - entry['time']
+		current = Mav.__calibration_params(name, params)
+		return 0 <= age < Mav.CALIBRATION_MAX_AGE and len(current) > 0 and current == entry['params']
 
 	async def init_connection(self):
+		start = lap = time.monotonic()
+
+		def phase(name):
+			nonlocal lap
+			now = time.monotonic()
+			self.startup[name] = round(now - lap, 3)
+			lap = now
+
 		# connect
 		await self.__mav.connect(system_address='serial:///dev/ttyAMA0')
 		logging.info("waiting for connection state...")
@@ -32,45 +86,190 @@ class Mav(MavBase):
 			if state.is_connected:
 				break
 		logging.info("connected")
+		phase('connect')
+		# whatever the autopilot held before is unknown
+		self.__mission = None
+		self.__rtl_set = False
 
-		# use mavlink instead of rc http://docs.px4.io/master/en/advanced_config/parameter_reference.html
-		await self.__mav.param.set_param_int('COM_RC_IN_MODE', 2)
-		logging.info("changed COM_RC_IN_MODE to 2")
+		params = await self.__read_params()
+		phase('params')
 
-		# calibrate
-		logging.info("starting gyroscope calibration")
-		async for progress_data in self.__mav.calibration.calibrate_gyro():
-			logging.info(progress_data)
-		logging.info("gyroscope calibration finished")
-		logging.info("starting board level horizon calibration")
-		async for progress_data in self.__mav.calibration.calibrate_level_horizon():
-			logging.info(progress_data)
-		logging.info("board level calibration finished")
+		for name, value in Mav.PARAMS.items():
+			if params.get(name) != value:
+				await self.__mav.param.set_param_int(name, value)
+				params[name] = value
+				logging.info(f"changed {name} to {value}")
+		phase('configure')
+
+		# calibrate, unless the autopilot still holds a calibration we made
+		calibrations = Mav.__load_calibrations()
+		calibrated = []
+		for name, calibrate in (('gyro', self.__mav.calibration.calibrate_gyro),
+								('level', self.__mav.calibration.calibrate_level_horizon)):
+			if not self.recalibrate and Mav.__calibration_valid(name, calibrations, params):
+				logging.info(f"{name} calibration from {time.ctime(calibrations[name]['time'])} still valid")
+				continue
+
+			logging.info(f"starting {name} calibration")
+			async for progress_data in calibrate():
+				logging.info(progress_data)
+			logging.info(f"{name} calibration finished")
+			calibrated.append(name)
+			phase(name)
+
+		if calibrated:
+			# the first dump has the names, only the calibration params are read again
+			names = [key for name in calibrated for key in Mav.__calibration_params(name, params)]
+			values = await asyncio.gather(*[(self.__mav.param.get_param_int if isinstance(params[key], int)
+											 else self.__mav.param.get_param_float)(key) for key in names])
+			params.update(zip(names, values))
+			for name in calibrated:
+				calibrations[name] = {'time': time.time(), 'params': Mav.__calibration_params(name, params)}
+			with open(Mav.CALIBRATION_STATE, 'w') as f:
+				json.dump(calibrations, f, indent=1)
+			phase('save')
+
+		await self.subscriptions.apply('idle')
+		phase('telemetry')
+		logging.info(f"ready after {time.monotonic() - start:.1f}s: {self.startup}")
 
 	async def gather_telemetry(self):
-		await asyncio.gather(self.__get_battery(), self.__get_pos())
+		await asyncio.gather(self.subscriptions.run(), self.__watch_mission())
 
-	async def arm(self):
+	async def __watch_mission(self):
+		# another component (a ground station) uploaded or changed the plan, the held one is gone
+		async for _ in self.__mav.mission_raw.mission_changed():
+			if self.__mission is not None:
+				logging.warning("the mission was changed on the autopilot")
+			self.__mission = None
+
+	async def set_telemetry_profile(self, profile):
+		await self.subscriptions.apply(profile)
+
+	def absolute_altitude(self, relative_altitude):
+		# AMSL of home from the latest position message
+		position = self.subscriptions.last.get('position')
+		if position is None:
+			raise RuntimeError("no position received yet, home altitude unknown")
+		return position.absolute_altitude_m - position.relative_altitude_m + relative_altitude
+
+	async def __wait_for(self, name, condition):
+		# streams are already read by gather_telemetry
+		queue = self.subscriptions.listen(name)
+		try:
+			value = self.subscriptions.last.get(name)
+			while value is None or not condition(value):
+				value = await queue.get()
+				logging.debug(value)
+		finally:
+			self.subscriptions.unlisten(name, queue)
+
+	async def __wait_for_health(self):
 		logging.info("waiting for global position estimate")
-		async for health in self.__mav.telemetry.health():
-			logging.debug(health)
-			if health.is_global_position_ok:
-				logging.info("global position estimate ok")
-				break
+		await self.__wait_for('health', lambda health: health.is_global_position_ok)
+		logging.info("global position estimate ok")
+
+	async def __check_params(self):
+		# one request per param, concurrently, instead of reading all of them
+		values = await asyncio.gather(*[self.__mav.param.get_param_int(name) for name in Mav.PARAMS])
+		for (name, value), current in zip(Mav.PARAMS.items(), values):
+			if current != value:
+				await self.__mav.param.set_param_int(name, value)
+				logging.warning(f"{name} was {current}, changed to {value}")
+
+	async def __report_takeoff(self, start):
+		await self.__wait_for('in_air', bool)
+		self.preflight['takeoff'] = round(time.monotonic() - start, 3)
+		logging.info(f"took off {self.preflight['takeoff']:.1f}s after the mission was handed over")
+
+	async def arm(self):
+		await self.__wait_for_health()
 		await self.__mav.action.arm()
 
+	@staticmethod
+	def __item_key(item):
+		return (item.latitude_deg, item.longitude_deg, item.relative_altitude_m, item.speed_m_s,
+				item.is_fly_through, item.acceptance_radius_m)
+
+	@staticmethod
+	def fingerprint(mission_items):
+		keys = [Mav.__item_key(item) for item in mission_items]
+		return hashlib.sha1(repr(keys).encode()).hexdigest()[:12]
+
+	@staticmethod
+	def __resume_index(held, mission_items):
+		# index of mission_items in the held plan, if they are a suffix of it
+		keys = [Mav.__item_key(item) for item in mission_items]
+		if held is None or len(keys) < 1 or len(keys) > len(held):
+			return None
+
+		start = len(held) - len(keys)
+		return start if held[start:] == keys else None
+
+	async def __prepare_mission(self, mission_items):
+		start = Mav.__resume_index(self.__mission, mission_items)
+		if start is not None:
+			# still held: __watch_mission forgets the plan once anything else changes it
+			saved = self.__upload_rate * len(mission_items)
+			self.mission_stats['skipped' if start == 0 else 'resumed'] += 1
+			self.mission_stats['saved_s'] += saved
+			logging.info(f"mission {Mav.fingerprint(mission_items)} already on the autopilot, "
+						 f"resuming at item {start}, saved ~{saved:.1f}s")
+			await self.__mav.mission.set_current_mission_item(start)
+			return
+
+		begin = time.monotonic()
+		if not self.__rtl_set:
+			await self.__mav.mission.set_return_to_launch_after_mission(False)
+			self.__rtl_set = True
+		self.__mission = None
+		await self.__mav.mission.upload_mission(mavsdk.mission.MissionPlan(mission_items))
+		self.__mission = [Mav.__item_key(item) for item in mission_items]
+
+		elapsed = time.monotonic() - begin
+		self.__upload_rate = elapsed / len(mission_items)
+		self.mission_stats['uploads'] += 1
+		self.mission_stats['upload_s'] += elapsed
+		logging.info(f"uploaded mission {Mav.fingerprint(mission_items)}, {len(mission_items)} items in {elapsed:.1f}s")
+
 	async def execute_mission(self, mission_items):
-		mission_plan = mavsdk.mission.MissionPlan(mission_items)
-		await self.__mav.mission.set_return_to_launch_after_mission(False)
-		await self.__mav.mission.upload_mission(mission_plan)
-		await self.arm()
-		await self.__mav.mission.start_mission()
-		async for progress in self.__mav.mission.mission_progress():
-			if progress.current == progress.total:
-				return
-
-	async def land(self):
-		# await do_landing(**{"mav": self, "mavsdk_system": self.__mav})
+		start = time.monotonic()
+		# waiting for GPS, the upload and the param check are independent; arming
+		# comes last, PX4 disarms again if the mission does not start within
+		# COM_DISARM_PRFLT (10s), which a long upload over serial would outlast
+		preflight = Preflight()
+		preflight.add('health', self.__wait_for_health, Mav.PREFLIGHT_TIMEOUTS['health'])
+		preflight.add('params', self.__check_params, Mav.PREFLIGHT_TIMEOUTS['params'])
+		preflight.add('upload', lambda: self.__prepare_mission(mission_items), Mav.PREFLIGHT_TIMEOUTS['upload'])
+		preflight.add('arm', self.__mav.action.arm, Mav.PREFLIGHT_TIMEOUTS['arm'],
+					  after=('health', 'params', 'upload'))
+		preflight.add('start', self.__mav.mission.start_mission, Mav.PREFLIGHT_TIMEOUTS['start'], after=('arm',))
+		try:
+			self.preflight = await preflight.run()
+		except PreflightError as e:
+			self.preflight = e.timings
+			if 'arm' in e.timings:
+				# armed but not started, do not leave the motors armed on the ground
+				try:
+					await self.__mav.action.disarm()
+				except mavsdk.action.ActionError as disarm_error:
+					logging.warning(f"could not disarm after the failed preflight: {disarm_error}")
+			raise
+
+		takeoff = asyncio.ensure_future(self.__report_takeoff(start))
+		try:
+			# the progress of a finished earlier run of the same plan may come first
+			started = False
+			async for progress in self.__mav.mission.mission_progress():
+				if progress.current < progress.total:
+					started = True
+				elif started:
+					return
+		finally:
+			takeoff.cancel()
+
+	async def land(self, facility=None):
+		# await do_landing(**{"mav": self, "mavsdk_system": self.__mav, "target": facility})
 		await self.__mav.action.land()
 
 	async def disarm(self):
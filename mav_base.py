@@ -1,21 +1,54 @@
 import logging
 
+from telemetry import Telemetry
+
 class MavBase:
 
 	def __init__(self, battery=1.0, pos=[0.0, 0.0]):
+		# timestamped history of everything the mav reports, see telemetry.py
+		self.telemetry = Telemetry()
 		self.battery = battery # 0.0 - 1.0
 		self.pos = pos # lat, lon
-	
+
+	@property
+	def pos(self):
+		return self.telemetry.latest('position')[:2].tolist()
+
+	@pos.setter
+	def pos(self, pos):
+		self.telemetry.record('position', (pos[0], pos[1], pos[2] if len(pos) > 2 else float('nan')))
+
+	@property
+	def battery(self):
+		return float(self.telemetry.latest('battery')[0])
+
+	@battery.setter
+	def battery(self, battery):
+		self.telemetry.record('battery', (battery,))
+
+	# lat, lon at time.monotonic() timestamp, e.g. the one of a camera frame
+	def position_at(self, timestamp):
+		return self.telemetry.at('position', timestamp)[:2].tolist()
+
+	# altitude goto_location takes for relative_altitude m above home; mocks fly relative to home
+	def absolute_altitude(self, relative_altitude):
+		return relative_altitude
+
 	async def init_connection(self):
 		logging.warning("called abstract function")
 
 	async def gather_telemetry(self):
 		logging.warning("called abstract function")
 
+	# idle | mission | landing, see telemetry.Subscriptions; without it the autopilot's rates apply
+	async def set_telemetry_profile(self, profile):
+		pass
+
 	async def execute_mission(self, mission_items):
 		logging.warning("called abstract function")
 
-	async def land(self):
+	# facility: the Facility whose pad to land on, None for wherever the drone is
+	async def land(self, facility=None):
 		logging.warning("called abstract function")
 
 	async def disarm(self):
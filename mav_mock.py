@@ -8,8 +8,10 @@ class Mav(MavBase):
 	STARTING_POS = [51.72437634851853, 14.33875342899223]
 	SPEED_MS = 40 # m/s
 
-	def __init__(self):
+	def __init__(self, simulate_landing=False):
 		super().__init__(pos=Mav.STARTING_POS)
+		# land through the vision loop on a simulated camera, see simulation.py
+		self.simulate_landing = simulate_landing
 
 	def flight_step(self, next_item, mission_items):
 		pos0 = self.pos
@@ -17,8 +19,8 @@ class Mav(MavBase):
 		d = haversine(pos0, pos1) * 1000
 		p = 1.0 if d == 0.0 or Mav.SPEED_MS >= d else Mav.SPEED_MS / d
 		logging.info(f"item {next_item:02d}/{len(mission_items):02d} at dist {d:.0f}m")
-		self.pos[0] += (pos1[0] - pos0[0]) * p
-		self.pos[1] += (pos1[1] - pos0[1]) * p
+		# pos is read from the telemetry store, so it is assigned, not mutated
+		self.pos = [pos0[0] + (pos1[0] - pos0[0]) * p, pos0[1] + (pos1[1] - pos0[1]) * p]
 		return next_item+1 if p == 1.0 else next_item
 
 	async def execute_mission(self, mission_items):
@@ -29,8 +31,12 @@ class Mav(MavBase):
 			await asyncio.sleep(1)
 			i = self.flight_step(i, mission_items)
 
-	async def land(self):
-		logging.info('landing')
+	async def land(self, facility=None):
+		logging.info(f"landing on {facility.id if facility else 'the spot'}")
+		if self.simulate_landing:
+			from simulation import simulate_landing
+			report = await simulate_landing(self, target=facility)
+			logging.info(f"simulated landing: {report}")
 
 	async def disarm(self):
 		logging.info('disarmed')
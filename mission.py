@@ -12,9 +12,9 @@ class Mission:
 
     # construct Mission instance from an HTTP response
     def __init__(self, raw, battery):
-        self.start = Facility(raw['start']['id'], (raw['start']['pos'][0], raw['start']['pos'][1]))
+        self.start = Facility.from_raw(raw['start'])
         self.waypoints = [(pos[0], pos[1]) for pos in raw['waypoints']]
-        self.goal = Facility(raw['goal']['id'], (raw['goal']['pos'][0], raw['goal']['pos'][1]))
+        self.goal = Facility.from_raw(raw['goal'])
         self.batteryStart = battery
 
     # create mavsdk.mission.MissionItem with default values
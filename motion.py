@@ -1,39 +1,136 @@
 import numpy as np
 
-from utils.tracking import iou_tracker, convert_bbox_to_z, convert_x_to_bbox, associate
-from filterpy.kalman import KalmanFilter
-from pycoral.adapters import detect
+from utils.tracking import convert_bbox_to_z, convert_x_to_bbox, associate
+from utils.kernels import bbox_to_z, x_to_bbox, size_mask, suppress
+
+
+class KalmanBank(object):
+    """ Constant velocity Kalman filters of all tracks in stacked arrays.
+
+    State per track: [x, y, s, r, dx, dy, ds] (center, area, aspect ratio and
+    their velocities), measurement [x, y, s, r]. Each track owns a slot in
+    `x` (capacity, 7, 1) and `P` (capacity, 7, 7); `predict` and `update`
+    handle any number of slots with one batched matrix product. Slots stay
+    fixed for the lifetime of a track, the arrays grow when full.
+    """
+    # state transistion matrix
+    F = np.array(
+        [[1, 0, 0, 0, 1, 0, 0],
+         [0, 1, 0, 0, 0, 1, 0],
+         [0, 0, 1, 0, 0, 0, 1],
+         [0, 0, 0, 1, 0, 0, 0],
+         [0, 0, 0, 0, 1, 0, 0],
+         [0, 0, 0, 0, 0, 1, 0],
+         [0, 0, 0, 0, 0, 0, 1]], dtype=np.float64)
+    # measurement function
+    H = np.array(
+        [[1, 0, 0, 0, 0, 0, 0],
+         [0, 1, 0, 0, 0, 0, 0],
+         [0, 0, 1, 0, 0, 0, 0],
+         [0, 0, 0, 1, 0, 0, 0]], dtype=np.float64)
+    # measurement uncertainty / noise
+    R = np.diag([1., 1., 10., 10.])
+    # process uncertainty / noise
+    Q = np.diag([1., 1., 1., 1., 0.01, 0.01, 0.0001])
+    # initial covariance matrix
+    P0 = np.diag([10., 10., 10., 10., 10000., 10000., 10000.])
+
+    def __init__(self, capacity=8):
+        self.x = np.zeros((capacity, 7, 1))
+        self.P = np.zeros((capacity, 7, 7))
+        self.used = np.zeros(capacity, dtype=bool)
+
+    def __grow(self):
+        capacity = len(self.used)
+        self.x = np.concatenate((self.x, np.zeros((capacity, 7, 1))))
+        self.P = np.concatenate((self.P, np.zeros((capacity, 7, 7))))
+        self.used = np.concatenate((self.used, np.zeros(capacity, dtype=bool)))
+
+    def add(self, z):
+        free = np.flatnonzero(~self.used)
+        if len(free) < 1:
+            self.__grow()
+            free = np.flatnonzero(~self.used)
+
+        slot = free[0]
+        self.x[slot] = 0.
+        self.x[slot, :4] = z
+        self.P[slot] = KalmanBank.P0
+        self.used[slot] = True
+
+        return slot
+
+    def remove(self, slot):
+        self.used[slot] = False
+
+    def predict(self, slots):
+        x, P = self.x[slots], self.P[slots]
+
+        # the area must not shrink below zero
+        x[(x[:, 6, 0] + x[:, 2, 0]) <= 0, 6] *= 0.0
+
+        self.x[slots] = KalmanBank.F @ x
+        self.P[slots] = KalmanBank.F @ P @ KalmanBank.F.T + KalmanBank.Q
+
+    def update(self, slots, z):
+        # z: (n, 4, 1) measurements of the tracks in slots
+        x, P = self.x[slots], self.P[slots]
+        H, R = KalmanBank.H, KalmanBank.R
+
+        y = z - H @ x
+        PHT = P @ H.T
+        S = H @ PHT + R
+        K = PHT @ np.linalg.inv(S)
+
+        # Joseph form, numerically stable like filterpy's update
+        I_KH = np.eye(7) - K @ H
+        self.x[slots] = x + K @ y
+        self.P[slots] = I_KH @ P @ I_KH.transpose(0, 2, 1) + K @ R @ K.transpose(0, 2, 1)
+
+
+class KalmanSlot(object):
+    """ Filter of a single track, a view on its slot in a KalmanBank """
+    __slots__ = ('bank', 'slot')
+
+    def __init__(self, bank, slot):
+        self.bank = bank
+        self.slot = slot
+
+    @property
+    def x(self):
+        return self.bank.x[self.slot]
+
+    @property
+    def P(self):
+        return self.bank.P[self.slot]
+
+    def predict(self):
+        self.bank.predict([self.slot])
+
+    def update(self, z):
+        self.bank.update([self.slot], np.reshape(z, (1, 4, 1)))
 
 
 class KalmanBoxTracker(object):
-    def __init__(self, bbox, min_hits, count=0, num_classes=1, interval=1):
-        self.kf = KalmanFilter(dim_x=7, dim_z=4)
-        # state transistion matrix
-        self.kf.F = np.array(
-            [[1, 0, 0, 0, 1, 0, 0],
-             [0, 1, 0, 0, 0, 1, 0],
-             [0, 0, 1, 0, 0, 0, 1],
-             [0, 0, 0, 1, 0, 0, 0],
-             [0, 0, 0, 0, 1, 0, 0],
-             [0, 0, 0, 0, 0, 1, 0],
-             [0, 0, 0, 0, 0, 0, 1]])
-        # measurement function
-        self.kf.H = np.array(
-            [[1, 0, 0, 0, 0, 0, 0],
-             [0, 1, 0, 0, 0, 0, 0],
-             [0, 0, 1, 0, 0, 0, 0],
-             [0, 0, 0, 1, 0, 0, 0]])
-
-        self.kf.R[2:, 2:] *= 10.    # measurement uncertainty / noise
-        self.kf.P[4:, 4:] *= 1000.  # covariance matrix
-        self.kf.P *= 10.
-        self.kf.Q[-1, -1] *= 0.01   # process uncertainty / noise
-        self.kf.Q[4:, 4:] *= 0.01
-
-        self.kf.x[:4] = convert_bbox_to_z(bbox)  # filter state estimate
+    """ One track: its filter slot and the counters the Tracker keeps on it.
+
+    `history` is a ring buffer of the last HISTORY predicted boxes since the
+    last update (`history_count` of them were written), so a track coasting
+    through a long occlusion keeps a constant size.
+    """
+    HISTORY = 8
+
+    __slots__ = ('kf', 'time_since_update', 'id', 'history', 'history_count', 'hits', 'hit_streak', 'age',
+                 'vip', 'min_hits', 'max_age', 'is_detect', 'num_classes', 'interval', 'label_memory', 'labelID')
+
+    def __init__(self, bbox, min_hits, count=0, num_classes=1, interval=1, bank=None):
+        bank = bank if bank is not None else KalmanBank(capacity=1)
+        # filter state estimate
+        self.kf = KalmanSlot(bank, bank.add(convert_bbox_to_z(bbox)))
         self.time_since_update = 0
         self.id = count
-        self.history = []
+        self.history = np.zeros((KalmanBoxTracker.HISTORY, 4))
+        self.history_count = 0
         self.hits = 0
         self.hit_streak = 1
         self.age = 0
@@ -41,8 +138,6 @@ class KalmanBoxTracker(object):
         self.min_hits = min_hits
 
         # add for relative max_age of the object
-        self.previous_x = self.kf.x
-        self.obj_speed = 0.
         self.max_age = 0.
         self.is_detect = 0
         # add for saving labels
@@ -54,26 +149,31 @@ class KalmanBoxTracker(object):
 
     def update(self, bbox):
         # bbox: [x1, y1, x2, y2, label_id]
+        self.kf.update(convert_bbox_to_z(bbox))
+        self.updated(bbox)
+
+    def updated(self, bbox):
+        # bookkeeping after the filter took bbox, see Tracker.update
         self.time_since_update = 0
-        self.history = []
+        self.history_count = 0
         self.hits += 1
         self.hit_streak += 1
-        self.kf.update(convert_bbox_to_z(bbox))
-        self.previous_x = self.kf.x
         self.is_detect = 1
         self.max_age = self.calculate_max_age()
         self.label_memory[int(bbox[4])] += 1
-        self.label_id = np.argmax(self.label_memory)
+        self.labelID = np.argmax(self.label_memory)
 
         if self.hit_streak >= self.min_hits:
             self.vip = True
 
     def predict(self, active=True):
-        #
-        if (self.kf.x[6] + self.kf.x[2]) <= 0:
-            self.kf.x[6] *= 0.0
-        self.previous_x = self.kf.x
         self.kf.predict()
+
+        return self.predicted(active)
+
+    def predicted(self, active=True, box=None):
+        # bookkeeping after the filter stepped ahead, box is the (1, 4) state
+        # when the caller already converted it, see Tracker.update
         self.age += 1
 
         if self.time_since_update > 0:
@@ -81,10 +181,15 @@ class KalmanBoxTracker(object):
 
         if active:
             self.time_since_update += 1
-        self.history.append(convert_x_to_bbox(self.kf.x))
+        box = box if box is not None else convert_x_to_bbox(self.kf.x)
+        self.history[self.history_count % KalmanBoxTracker.HISTORY] = box
+        self.history_count += 1
         self.is_detect = 0
 
-        return self.history[-1]
+        return box
+
+    def release(self):
+        self.kf.bank.remove(self.kf.slot)
 
     def get_state(self):
         return convert_x_to_bbox(self.kf.x)
@@ -104,32 +209,45 @@ class KalmanBoxTracker(object):
 
 
 class Tracker(object):
-    def __init__(self, shape, min_hits=0, num_classes=1, interval=1):
+    def __init__(self, shape, min_hits=0, num_classes=1, interval=1, min_size=None):
         self.img_shape = shape
         self.min_hits = min_hits
         self.num_classes = num_classes
         self.interval = interval
         self.trackers = []
+        self.bank = KalmanBank()
         self.frame_count = 0
         self.kalman_count = 0
         self.skip_ratio = 0.04
+        # px, the smallest box kept regardless of shape; skip_ratio of it if None
+        self.min_size = min_size
 
-    def update(self, obj_detections, obj_labels, active=True):
+    def update(self, obj_detections, obj_labels, active=True, zoom=1.):
         self.frame_count += 1
 
-        # delete too small objects
-        detections = []
-        for idx in range(obj_detections.shape[0]):
-            if (obj_detections[idx][2] - obj_detections[idx][0] >= self.skip_ratio * self.img_shape[0]) and (
-                    obj_detections[idx][3] - obj_detections[idx][1] >= self.skip_ratio * self.img_shape[1]):
-                detections.append(np.hstack((obj_detections[idx], obj_labels[idx])))
-        detections = np.asarray(detections)
+        # delete too small objects, detections made on a magnified crop
+        # (zoom > 1) were seen at a higher resolution and may be smaller
+        if self.min_size is not None:
+            min_w = min_h = self.min_size / zoom
+        else:
+            min_w = self.skip_ratio * self.img_shape[0] / zoom
+            min_h = self.skip_ratio * self.img_shape[1] / zoom
+        detections = np.asarray([])
+        if len(obj_detections) > 0:
+            keep = size_mask(obj_detections, min_w, min_h)
+            if np.any(keep):
+                detections = np.column_stack((obj_detections[keep], np.asarray(obj_labels)[keep]))
+
+        # one batched predict for the filters of all tracks
+        slots = [trk.kf.slot for trk in self.trackers]
+        self.bank.predict(slots)
+        boxes = x_to_bbox(self.bank.x[slots, :, 0])
 
         trks = np.zeros((len(self.trackers), 5))
         tdel = []
         ret0 = []
         for t, trk in enumerate(trks):  # t: index, trk: content
-            pos = self.trackers[t].predict(active=active)[0]
+            pos = self.trackers[t].predicted(active=active, box=boxes[t:t + 1])[0]
             trk[:] = [pos[0], pos[1], pos[2], pos[3], 0]
             if np.any(np.isnan(pos)):  # np.isnan: test element-wise for NaN and return result as a bollean array
                 tdel.append(t)
@@ -138,21 +256,30 @@ class Tracker(object):
         # np.ma.compress_rows: Suppresss whole rows of a 2-D array that contain masked values
         trks = np.ma.compress_rows(np.ma.masked_invalid(trks))
         for t in reversed(tdel):
-            self.trackers.pop(t)
+            self.trackers.pop(t).release()
 
         # Hungarian data association
         matched, unmateched_detections, unmatched_trks = associate(detections, trks)
 
+        # detection index matched to each tracker, -1 if none
+        matched_detection = np.full(len(self.trackers), -1)
+        matched_detection[matched[:, 1]] = matched[:, 0]
+
+        updates = []
         for t, trk in enumerate(self.trackers):
-            if t not in unmatched_trks:
-                # np.where returns two array, one is row index, another is column.
-                # [[]]->[] dimension changed from (a,b) to (a)
-                d = matched[np.where(matched[:, 1] == t)[0], 0]
-                trk.update(detections[d, :][0])
+            if matched_detection[t] >= 0:
+                updates.append((trk, detections[matched_detection[t], :]))
+
+        # one batched update for the filters of all matched tracks
+        if len(updates) > 0:
+            self.bank.update([trk.kf.slot for trk, _ in updates],
+                             bbox_to_z(np.stack([bbox for _, bbox in updates]))[:, :, None])
+            for trk, bbox in updates:
+                trk.updated(bbox)
 
         for i in unmateched_detections:
             trk = KalmanBoxTracker(detections[i, :], min_hits=self.min_hits, count=self.kalman_count,
-                                   num_classes=self.num_classes, interval=self.interval)
+                                   num_classes=self.num_classes, interval=self.interval, bank=self.bank)
             self.kalman_count += 1
             self.trackers.append(trk)
 
@@ -170,7 +297,7 @@ class Tracker(object):
             i -= 1
 
             if trk.time_since_update > trk.max_age:
-                self.trackers.pop(i)
+                self.trackers.pop(i).release()
 
         if len(ret0) > 0:
             # return np.concatenate(ret1)
@@ -186,44 +313,7 @@ class Tracker(object):
         detections = detections.astype(np.uint16)
 
         # x1, y1, x2, y2, id, is_dect:[0, 1]
-        num_objects = detections.shape[0]
-        flags = np.ones(num_objects, dtype=np.uint8)
-
-        new_detections = []
-        for idx_a in range(num_objects):
-            for idx_b in range(idx_a+1, num_objects):
-                if flags[idx_b] == 0:
-                    continue
-
-                if active:
-                    # If A include B, and B is predicted then delete B
-                    if (detections[idx_a, 0] <= detections[idx_b, 0]) and (detections[idx_a, 1] <= detections[idx_b, 1]) and (
-                        detections[idx_a, 2] >= detections[idx_b, 2]) and (detections[idx_a, 3] >= detections[idx_b, 3]) and (
-                            detections[idx_b, 5] == 0):
-                            flags[idx_b] = 0
-                            continue
-                    # B inlcude A, and A is predicted tehn delete A
-                    elif (detections[idx_a, 0] >= detections[idx_b, 0]) and (detections[idx_a, 1] >= detections[idx_b, 1]) and (
-                        detections[idx_a, 2] <= detections[idx_b, 2]) and (detections[idx_a, 3] <= detections[idx_b, 3]) and (
-                            detections[idx_a, 5] == 0):
-                            flags[idx_a] = 0
-                            break
-
-                iou = iou_tracker(detections[idx_a], detections[idx_b])
-                if iou >= 0.3:
-                    if detections[idx_a, 5] == 0: # (false, false) and (false, true)
-                        flags[idx_a] = 0
-                        break
-                    else:
-                        if detections[idx_b, 5] == 0: # (true, false)
-                            flags[idx_b] = 0
-                            continue
-                        else: # (true, true)
-                            flags[idx_a] = 0
-                            break
-
-        for idx in range(num_objects):
-            if flags[idx] == 1:
-                new_detections.append(detections[idx])
-
-        return np.asarray(new_detections)
\ No newline at end of file
+        # compiled loop, or utils.kernels.suppress_matrix without numba
+        flags = suppress(detections, active)
+
+        return detections[flags == 1]
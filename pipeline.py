@@ -0,0 +1,123 @@
+import asyncio
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Stage(object):
+    """ One step of a Pipeline.
+
+    `fn` takes an item and returns the item for the next stage, or None to
+    drop it. Blocking stages run in the pipeline's thread pool (OpenCV and the
+    tflite interpreter release the GIL), everything else runs on the event
+    loop. Stages that keep state between frames (interpreter, tracker) must
+    use a single worker so items leave them in the order they arrived.
+    """
+
+    def __init__(self, name, fn, workers=1, blocking=True):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.blocking = blocking
+        self.processed = 0
+        self.dropped = 0
+        self.busy = 0.
+
+    def stats(self):
+        mean = self.busy / self.processed if self.processed > 0 else 0.
+        return {'processed': self.processed, 'dropped': self.dropped,
+                'mean_ms': mean * 1000}
+
+
+class Pipeline(object):
+    """ Runs items through stages connected by bounded queues.
+
+    At most `depth` items are in flight at once, so the source is only asked
+    for a new item once a slot frees up - with a FrameGrabber source this
+    means every item enters the pipeline with the newest frame available.
+    While stage k works on item N, stage k-1 already works on item N+1.
+    """
+
+    def __init__(self, stages, depth=None, executor=None):
+        self.stages = stages
+        self.depth = depth if depth is not None else len(stages)
+        self.executor = executor if executor is not None else ThreadPoolExecutor(
+            max_workers=sum(stage.workers for stage in stages if stage.blocking),
+            thread_name_prefix='pipeline')
+        self.__queues = [asyncio.Queue(maxsize=1) for _ in range(len(stages) + 1)]
+        self.__slots = None
+
+    async def __work(self, stage, inbox, outbox):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            item = await inbox.get()
+            start = time.perf_counter()
+            if stage.blocking:
+                item = await loop.run_in_executor(self.executor, stage.fn, item)
+            else:
+                item = stage.fn(item)
+            stage.busy += time.perf_counter() - start
+            stage.processed += 1
+
+            if item is None:
+                stage.dropped += 1
+                self.__slots.release()
+                continue
+
+            await outbox.put(item)
+
+    async def __feed(self, source):
+        while True:
+            await self.__slots.acquire()
+            item = await source()
+
+            if item is None:
+                self.__slots.release()
+                return
+
+            await self.__queues[0].put(item)
+
+    async def __drain(self, sink):
+        while True:
+            item = await self.__queues[-1].get()
+            try:
+                if await sink(item):
+                    return
+            finally:
+                self.__slots.release()
+
+    async def __flush(self):
+        for _ in range(self.depth):
+            await self.__slots.acquire()
+
+    async def run(self, source, sink):
+        """ Pulls items from `await source()` until it returns None or `await sink(item)` returns True """
+        self.__slots = asyncio.Semaphore(self.depth)
+        workers = [
+            asyncio.create_task(self.__work(stage, self.__queues[i], self.__queues[i + 1]))
+            for i, stage in enumerate(self.stages) for _ in range(stage.workers)
+        ]
+        feed = asyncio.create_task(self.__feed(source))
+        drain = asyncio.create_task(self.__drain(sink))
+
+        try:
+            done, _ = await asyncio.wait(workers + [feed, drain], return_when=asyncio.FIRST_COMPLETED)
+            if done == {feed} and feed.exception() is None:
+                # let the items that are still in flight reach the sink
+                flush = asyncio.create_task(self.__flush())
+                done, _ = await asyncio.wait(workers + [flush, drain], return_when=asyncio.FIRST_COMPLETED)
+                flush.cancel()
+            for task in done:
+                task.result()  # re-raise what went wrong inside a stage
+        finally:
+            for task in workers + [feed, drain]:
+                task.cancel()
+            await asyncio.gather(*workers, feed, drain, return_exceptions=True)
+
+        for stage in self.stages:
+            logging.info(f"pipeline: {stage.name} {stage.stats()}")
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import time
+
+
+class PreflightError(Exception):
+	""" A preflight step failed or timed out; `timings` of the steps that finished """
+
+	def __init__(self, step, timings, reason):
+		super().__init__(f"preflight step {step} {reason}")
+		self.step = step
+		self.timings = dict(timings)
+
+
+class Preflight:
+	""" Runs the steps before a mission concurrently, each one as soon as the
+	steps it depends on are done.
+
+	Every step has its own timeout; the first step that fails or times out
+	cancels the others and `run` raises a PreflightError naming it. `timings`
+	holds the start and end of each step in s since `run` was called.
+	"""
+
+	def __init__(self):
+		self.steps = {}
+		self.timings = {}
+
+	def add(self, name, run, timeout, after=()):
+		""" `run` is called without arguments and returns an awaitable """
+		self.steps[name] = (run, timeout, tuple(after))
+
+	async def __step(self, name, tasks, start):
+		run, timeout, after = self.steps[name]
+		if after:
+			await asyncio.gather(*[tasks[dependency] for dependency in after])
+
+		begin = time.monotonic()
+		try:
+			result = await asyncio.wait_for(run(), timeout)
+		except asyncio.TimeoutError:
+			raise PreflightError(name, self.timings, f"timed out after {timeout}s") from None
+		except Exception as e:
+			raise PreflightError(name, self.timings, f"failed: {e!r}") from e
+		self.timings[name] = (round(begin - start, 3), round(time.monotonic() - start, 3))
+
+		return result
+
+	async def run(self):
+		start = time.monotonic()
+		tasks = {}
+		for name in self.steps:
+			# steps only start running at the await below, once all tasks exist
+			tasks[name] = asyncio.ensure_future(self.__step(name, tasks, start))
+
+		try:
+			await asyncio.gather(*tasks.values())
+		except BaseException:
+			for task in tasks.values():
+				task.cancel()
+			await asyncio.gather(*tasks.values(), return_exceptions=True)
+			raise
+
+		logging.info(f"preflight done after {time.monotonic() - start:.1f}s: {self.timings}")
+		return self.timings
@@ -0,0 +1,368 @@
+"""
+Recording of landing approaches and their offline replay.
+
+A recording is a directory:
+
+    meta.json           frame shape and dtype, frames per chunk
+    frames-00000.raw    raw frames, `chunk_frames` per file
+    index.bin           one INDEX record per frame
+    detections.bin      float64 rows [frame, x1, y1, x2, y2, score, label]
+    tracks.bin          float64 rows [frame, x1, y1, x2, y2, objID, is_update, labelID]
+
+Everything is appended while flying and memory-mapped for the replay, so
+long sessions never have to fit into RAM.
+
+$ python3 -m recording ./approach --realtime
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import numpy as np
+
+from collections import deque
+from capture import Frame
+from detector import Detector
+
+
+INDEX = np.dtype([('id', '<i8'), ('timestamp', '<f8'), ('active', '?'), ('pos', '<f8', (2,))])
+
+
+class Recorder(object):
+    """ Appends frames with what the landing loop made of them to a recording """
+
+    def __init__(self, path, chunk_frames=256):
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self.frames = 0
+        self.bytes = 0
+
+        self.__shape = None
+        self.__chunk = None
+        self.__lock = threading.Lock()   # the landing loop may close while a stage still writes
+        os.makedirs(path, exist_ok=True)
+        self.__index = open(os.path.join(path, 'index.bin'), 'wb')
+        self.__detections = open(os.path.join(path, 'detections.bin'), 'wb')
+        self.__tracks = open(os.path.join(path, 'tracks.bin'), 'wb')
+
+    def __start(self, image):
+        self.__shape = image.shape
+        with open(os.path.join(self.path, 'meta.json'), 'w') as f:
+            json.dump({'shape': list(image.shape), 'dtype': str(image.dtype),
+                       'chunk_frames': self.chunk_frames}, f)
+
+    def __rows(self, f, frame, rows, width):
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, width)
+        if len(rows) > 0:
+            f.write(np.column_stack((np.full(len(rows), frame), rows)).tobytes())
+
+    def write(self, frame, active, detections, tracks, pos):
+        """ `detections` (N, 6) detector rows, `tracks` (M, 7) Tracker.update rows, `pos` [lat, lon] """
+        with self.__lock:
+            if not self.__index.closed:
+                self.__write(frame, active, detections, tracks, pos)
+
+    def __write(self, frame, active, detections, tracks, pos):
+        if self.__shape is None:
+            self.__start(frame.image)
+        elif frame.image.shape != self.__shape:
+            raise ValueError(f"frame of shape {frame.image.shape} in a recording of {self.__shape}")
+
+        if self.frames % self.chunk_frames == 0:
+            if self.__chunk is not None:
+                self.__chunk.close()
+            self.__chunk = open(os.path.join(self.path, f"frames-{self.frames // self.chunk_frames:05d}.raw"), 'wb')
+
+        image = np.ascontiguousarray(frame.image)
+        self.__chunk.write(image.data)
+        self.bytes += image.nbytes
+
+        record = np.zeros(1, dtype=INDEX)
+        record[0] = (frame.id, frame.timestamp, active, pos[:2] if pos is not None else (np.nan, np.nan))
+        self.__index.write(record.tobytes())
+        self.__rows(self.__detections, self.frames, detections, 6)
+        self.__rows(self.__tracks, self.frames, tracks if tracks is not None else [], 7)
+        self.frames += 1
+
+    def close(self):
+        with self.__lock:
+            for f in (self.__chunk, self.__index, self.__detections, self.__tracks):
+                if f is not None:
+                    f.close()
+        logging.info(f"recorder: {self.frames} frames, {self.bytes / 2 ** 20:.0f}MiB in {self.path}")
+
+
+class RecordedImage(np.ndarray):
+    """ A frame of a recording that knows its index, crops of it do as well """
+
+    def __array_finalize__(self, obj):
+        self.index = getattr(obj, 'index', None)
+
+
+class Recording(object):
+    """ Read-only, memory-mapped view of a recording """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.shape = tuple(meta['shape'])
+        self.dtype = np.dtype(meta['dtype'])
+        self.chunk_frames = meta['chunk_frames']
+
+        self.index = np.memmap(os.path.join(path, 'index.bin'), dtype=INDEX, mode='r')
+        self.__detections = Recording.__rows(os.path.join(path, 'detections.bin'), 7)
+        self.__tracks = Recording.__rows(os.path.join(path, 'tracks.bin'), 8)
+        self.__chunks = {}
+
+    @staticmethod
+    def __rows(path, width):
+        if not os.path.exists(path) or os.path.getsize(path) < 1:
+            return np.empty((0, width))
+
+        return np.memmap(path, dtype=np.float64, mode='r').reshape(-1, width)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __chunk(self, number):
+        if number not in self.__chunks:
+            self.__chunks[number] = np.memmap(os.path.join(self.path, f"frames-{number:05d}.raw"),
+                                              dtype=self.dtype, mode='r').reshape((-1,) + self.shape)
+        return self.__chunks[number]
+
+    def image(self, i):
+        image = self.__chunk(i // self.chunk_frames)[i % self.chunk_frames].view(RecordedImage)
+        image.index = i
+
+        return image
+
+    def __select(self, rows, i):
+        # rows are appended in frame order
+        lo, hi = np.searchsorted(rows[:, 0], (i, i + 1))
+        return np.array(rows[lo:hi, 1:])
+
+    def detections(self, i):
+        return self.__select(self.__detections, i)
+
+    def tracks(self, i):
+        return self.__select(self.__tracks, i)
+
+    def pos(self, i):
+        return list(self.index[i]['pos'])
+
+
+class ReplayGrabber(object):
+    """ FrameGrabber interface on a recording.
+
+    As fast as possible every frame is handed out in order. In real time the
+    frames become available at their recorded pace and, like with a camera,
+    frames the consumer was too slow for are skipped (`dropped`). Frame
+    timestamps are the time a frame became available in the replay.
+    """
+
+    def __init__(self, recording, realtime=False):
+        self.recording = recording
+        self.realtime = realtime
+        self.dropped = 0
+        self.grabbed = 0
+        self.last_age = None
+        self.current = None     # index of the frame handed out last
+
+        # (timestamp, index) of the frames handed out last, the pipeline runs ahead of the estimate
+        self.__handed = deque(maxlen=64)
+        self.__next = 0
+        self.__start = None
+        self.__running = False
+
+    def start(self):
+        self.__start = time.monotonic()
+        self.__running = len(self.recording) > 0
+
+        return self
+
+    def stop(self):
+        self.__running = False
+
+    def is_running(self):
+        return self.__running
+
+    def __due(self, i):
+        timestamps = self.recording.index['timestamp']
+        return self.__start + (timestamps[i] - timestamps[0])
+
+    def __frame(self, i, timestamp):
+        self.dropped += i - self.__next
+        self.grabbed = i + 1
+        self.__next = i + 1
+        self.current = i
+        self.__handed.append((timestamp, i))
+        if self.__next >= len(self.recording):
+            self.__running = False
+
+        self.last_age = time.monotonic() - timestamp
+        return Frame(int(self.recording.index[i]['id']), timestamp, self.recording.image(i))
+
+    def index_at(self, timestamp):
+        """ Recording index of the frame handed out with `timestamp` (the latest one not after it) """
+        for handed, i in reversed(self.__handed):
+            if handed <= timestamp:
+                return i
+
+        return self.__handed[0][1] if self.__handed else 0
+
+    def latest_nowait(self):
+        if not self.__running:
+            return None
+        if not self.realtime:
+            return self.__frame(self.__next, time.monotonic())
+
+        # newest frame that is due by now
+        timestamps = self.recording.index['timestamp']
+        now = time.monotonic()
+        i = int(np.searchsorted(timestamps, timestamps[0] + (now - self.__start), side='right')) - 1
+        if i < self.__next:
+            return None
+
+        return self.__frame(i, self.__due(i))
+
+    async def latest(self):
+        while self.__running:
+            frame = self.latest_nowait()
+            if frame is not None:
+                await asyncio.sleep(0)
+                return frame
+
+            await asyncio.sleep(max(0., self.__due(self.__next) - time.monotonic()))
+
+        return None
+
+
+class RecordedDetector(Detector):
+    """ Hands out the detections recorded with a frame instead of running a model.
+
+    On frames the recorded run did not detect on (its scheduler skipped
+    them), the detections of the nearest frame it did detect on are used
+    and counted in `missing`.
+    """
+
+    def __init__(self, recording, threshold=0.):
+        super().__init__(recording.path, threshold)
+        self.recording = recording
+        self.input_size = (recording.shape[1], recording.shape[0])
+        self.missing = 0
+        self.__runs = np.flatnonzero(recording.index['active'])
+
+    def detect_roi(self, image, window):
+        # recorded boxes are in frame coordinates already
+        return self.detect(image)
+
+    def __nearest_run(self, i):
+        if len(self.__runs) < 1:
+            return i
+
+        k = np.searchsorted(self.__runs, i)
+        candidates = self.__runs[max(k - 1, 0):k + 1]
+        return int(candidates[np.argmin(np.abs(candidates - i))])
+
+    def _detect(self, image):
+        if getattr(image, 'index', None) is None:
+            raise ValueError("RecordedDetector only takes frames of its recording")
+
+        i = image.index
+        if not self.recording.index[i]['active']:
+            self.missing += 1
+            i = self.__nearest_run(i)
+
+        return self._filter(self.recording.detections(i).reshape(-1, 6))
+
+
+class ReplayMav(object):
+    """ Stands in for the Mav, positions are the recorded ones of the frames """
+
+    def __init__(self, recording, grabber):
+        self.recording = recording
+        self.grabber = grabber
+
+    @property
+    def pos(self):
+        return self.recording.pos(self.grabber.current or 0)
+
+    def position_at(self, timestamp):
+        # the frame the estimate was made on, not the newest one handed out
+        return self.recording.pos(self.grabber.index_at(timestamp))
+
+    def absolute_altitude(self, relative_altitude):
+        # ReplaySystem only records the setpoints
+        return relative_altitude
+
+
+class ReplaySystem(object):
+    """ mavsdk.System stub that records the commands instead of sending them """
+
+    class Plugin(object):
+        def __init__(self, system, name):
+            self.__system = system
+            self.__name = name
+
+        def __getattr__(self, command):
+            async def call(*args, **kwargs):
+                self.__system.calls.append((time.monotonic(), f"{self.__name}.{command}", args))
+
+            return call
+
+    def __init__(self):
+        self.calls = []
+        self.action = ReplaySystem.Plugin(self, 'action')
+        self.offboard = ReplaySystem.Plugin(self, 'offboard')
+
+
+async def replay(path, realtime=False, backend=None, **kwargs):
+    """ Runs a recording through do_landing, returns frames per second and decision latency.
+
+    Without a `backend` the recorded detections stand in for the detector.
+    """
+    from landing import do_landing
+
+    recording = Recording(path)
+    grabber = ReplayGrabber(recording, realtime)
+    if backend is None:
+        kwargs['detector'] = RecordedDetector(recording)
+    else:
+        kwargs['backend'] = backend
+    system = ReplaySystem()
+
+    start = time.monotonic()
+    stats = await do_landing(capture=grabber, mavsdk_system=system, mav=ReplayMav(recording, grabber), **kwargs)
+    elapsed = time.monotonic() - start
+
+    latency = np.asarray(stats['latency']) * 1000
+    report = {
+        'frames': len(recording),
+        'grabbed': grabber.grabbed,
+        'dropped': grabber.dropped,
+        'processed': len(latency),
+        'seconds': round(elapsed, 3),
+        'fps': round(len(latency) / elapsed, 1) if elapsed > 0 else None,
+        'landed': any(name == 'action.land' for _, name, _ in system.calls),
+        'setpoints': sum(name != 'action.land' for _, name, _ in system.calls),
+    }
+    if len(latency) > 0:
+        report.update({f"latency_p{q}_ms": round(float(np.percentile(latency, q)), 2) for q in (50, 95, 99)})
+
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path')
+    parser.add_argument('--realtime', action='store_true', help='replay at the recorded pace')
+    parser.add_argument('--backend', help='run this detector backend instead of the recorded detections')
+    parser.add_argument('--roi', action='store_true', help='detect on crops around the tracked pad')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.INFO)
+    print(json.dumps(asyncio.run(replay(args.path, args.realtime, args.backend, roi=args.roi)), indent=2))
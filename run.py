@@ -7,6 +7,7 @@ from mav import Mav
 from mav_mock import Mav as MavMock
 from connection import Connection
 from connection_mock import Connection as ConnectionMock
+from utils import kernels
 
 
 LOG = './drone.log'
@@ -23,12 +24,14 @@ def configure_logging():
 async def main():
 	configure_logging()
 	logging.info("configured logging")
+	# loaded from numba's cache before connecting, see utils/kernels.py
+	logging.info(f"tracking kernels ready in {kernels.load_time + kernels.warmup():.3f}s")
 
 	if '--mockmav' in sys.argv[1:]:
-		mav = MavMock()
+		mav = MavMock(simulate_landing='--simlanding' in sys.argv[1:])
 		logging.info('mocking mav')
 	else:
-		mav = Mav()
+		mav = Mav(recalibrate='--recalibrate' in sys.argv[1:])
 	await mav.init_connection()
 
 	drone = Drone(mav)
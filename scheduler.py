@@ -0,0 +1,87 @@
+import numpy as np
+
+
+class DetectionScheduler(object):
+    """ Decides per frame whether the detector has to run.
+
+    Instead of a fixed every-n-th frame, the gap between two detector runs
+    follows the state of the most established track: new, coasting or fast
+    moving tracks (and no track at all) get a detection every frame, a stable
+    track lets the gap grow up to `max_interval`. Once the pad is centered
+    enough that `ratio` drops below `approach_ratio`, the gap shrinks again
+    and reaches 1 at the touchdown threshold, so the last corrections are
+    made on fresh detections.
+
+    While the most established track is confident, `focus` holds its box
+    predicted for the next detector run, so the detector can look at a crop
+    around it instead of the whole frame. It is None otherwise. Once the
+    estimation found the target pad among several, its track is the one
+    followed.
+    """
+
+    def __init__(self, max_interval=6, stable_hits=5, fast_speed=8.,
+                 approach_ratio=0.6, touchdown_ratio=0.16):
+        self.max_interval = max_interval
+        self.stable_hits = stable_hits
+        self.fast_speed = fast_speed            # px / frame of the box center
+        self.approach_ratio = approach_ratio
+        self.touchdown_ratio = touchdown_ratio
+
+        self.interval = 1
+        self.focus = None
+        self.ratio = None
+        self.target = None  # objID of the target pad's track
+        self.runs = 0
+        self.skipped = 0
+        self.__since = 0
+
+    def __track_interval(self, trackers):
+        self.focus = None
+        if len(trackers) < 1:
+            return 1
+
+        targets = [t for t in trackers if t.id + 1 == self.target]
+        trk = targets[0] if targets else max(trackers, key=lambda t: t.hit_streak)
+        if trk.hit_streak < self.stable_hits or trk.time_since_update > 0:
+            return 1
+
+        # x, y, s, r, dx, dy, ds
+        speed = float(np.hypot(trk.kf.x[4], trk.kf.x[5]))
+        if speed >= self.fast_speed:
+            return 1
+
+        interval = max(1, int(round(self.max_interval * (1. - speed / self.fast_speed))))
+        self.focus = trk.get_state()[0] + np.tile(trk.kf.x[4:6, 0], 2) * interval
+
+        return interval
+
+    def __ratio_interval(self):
+        if self.ratio is None or self.ratio >= self.approach_ratio:
+            return self.max_interval
+
+        progress = (self.ratio - self.touchdown_ratio) / (self.approach_ratio - self.touchdown_ratio)
+        return max(1, int(round(self.max_interval * progress)))
+
+    def observe_tracks(self, tracker):
+        """ Call right after `Tracker.update`, from the thread that owns the tracker """
+        self.interval = min(self.__track_interval(tracker.trackers), self.__ratio_interval())
+
+    def observe_ratio(self, ratio, target=None):
+        if ratio is not None:
+            self.ratio = ratio
+            self.target = target
+            self.interval = min(self.interval, self.__ratio_interval())
+
+    def next(self):
+        """ Returns True if the detector should run on the next frame """
+        if self.__since + 1 >= self.interval:
+            self.__since = 0
+            self.runs += 1
+            return True
+
+        self.__since += 1
+        self.skipped += 1
+        return False
+
+    def stats(self):
+        return {'runs': self.runs, 'skipped': self.skipped, 'interval': self.interval}
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+
+
+class SetpointPublisher(object):
+    """ Sends landing corrections to the autopilot from its own task.
+
+    The vision loop only `submit`s targets and never waits on MAVLink. The
+    publisher holds a single slot: a target that was not sent yet is replaced
+    by a newer one (counted in `coalesced`), at most one goes out every
+    1 / `rate` seconds.
+
+    mode 'position' sends `action.goto_location` once per target, the
+    autopilot keeps flying to the last one. mode 'velocity' switches the
+    autopilot to offboard control and streams NED velocity setpoints every
+    period, the last target again (`resent`) while vision has no newer one;
+    PX4 leaves offboard mode when that stream stops. A velocity target older
+    than `hold_after` seconds is replaced by zero velocity (`held`), so the
+    drone hovers instead of flying the last correction on and on.
+    """
+
+    def __init__(self, system, rate=4., mode='position', hold_after=1.):
+        if mode not in ('position', 'velocity'):
+            raise ValueError(f"unknown setpoint mode '{mode}'")
+
+        self.system = system
+        self.period = 1. / rate
+        self.mode = mode
+        self.hold_after = hold_after
+        self.sent = 0
+        self.resent = 0
+        self.held = 0
+        self.coalesced = 0
+        self.failed = 0
+
+        self.__pending = None
+        self.__event = asyncio.Event()
+        self.__task = None
+
+    def __submit(self, setpoint):
+        if self.__pending is not None:
+            self.coalesced += 1
+        self.__pending = setpoint
+        self.__event.set()
+
+    def submit_position(self, latitude, longitude, altitude, yaw=0.):
+        self.__submit((latitude, longitude, altitude, yaw))
+
+    def submit_velocity(self, north, east, down, yaw=0.):
+        self.__submit((north, east, down, yaw))
+
+    async def __send(self, setpoint):
+        if self.mode == 'position':
+            await self.system.action.goto_location(*setpoint)
+        else:
+            from mavsdk.offboard import VelocityNedYaw
+
+            await self.system.offboard.set_velocity_ned(VelocityNedYaw(*setpoint))
+
+    async def __run(self):
+        loop = asyncio.get_running_loop()
+
+        if self.mode == 'velocity':
+            # offboard mode only starts with a setpoint already in place
+            await self.__send((0., 0., 0., 0.))
+            await self.system.offboard.start()
+
+        # in velocity mode the zero setpoint is streamed until the first target
+        current = (0., 0., 0., 0.) if self.mode == 'velocity' else None
+        submitted = loop.time()
+        while True:
+            if self.mode == 'position':
+                # goto_location holds, only new targets are sent
+                await self.__event.wait()
+
+            start = loop.time()
+            if self.__pending is not None:
+                current, submitted, self.__pending = self.__pending, start, None
+                self.__event.clear()
+                setpoint = current
+            elif self.mode == 'velocity' and start - submitted > self.hold_after:
+                setpoint = (0., 0., 0., current[3])
+                self.held += 1
+            else:
+                setpoint = current
+                self.resent += 1
+
+            try:
+                await self.__send(setpoint)
+                self.sent += 1
+            except Exception as e:
+                self.failed += 1
+                logging.warning(f"setpoint {setpoint} not sent: {e}")
+
+            await asyncio.sleep(max(0., self.period - (loop.time() - start)))
+
+    def start(self):
+        self.__task = asyncio.create_task(self.__run())
+
+        return self
+
+    async def stop(self):
+        if self.__task is None:
+            return
+
+        task, self.__task = self.__task, None
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+
+        if self.mode == 'velocity':
+            await self.system.offboard.stop()
+
+    def stats(self):
+        return {'sent': self.sent, 'resent': self.resent, 'held': self.held,
+                'coalesced': self.coalesced, 'failed': self.failed,
+                'pending': self.__pending is not None}
@@ -0,0 +1,322 @@
+"""
+Closed-loop landing simulation: a downward camera rendering the pad as seen
+from the mock drone, an autopilot stub that flies the corrections and an
+oracle detector, so the whole vision -> control loop runs without hardware.
+
+$ python3 -m simulation --approaches 16 --workers 4
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import time
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.synthetic import render_scene, pad_box
+from camera import CameraModel
+from capture import Frame
+from detector import Detector
+from utils.helpers import CALIB
+
+
+R_EARTH = 6371000.0     # in meters, as in landing
+
+
+def offset_to_position(lat, lon, north, east):
+    return (lat + (north / R_EARTH) * (180 / math.pi),
+            lon + (east / R_EARTH) * (180 / math.pi) / math.cos(lat * math.pi / 180))
+
+
+def position_to_offset(lat0, lon0, lat1, lon1):
+    """ (north, east) in meters from the first position to the second """
+    north = (lat1 - lat0) * math.pi / 180 * R_EARTH
+    east = (lon1 - lon0) * math.pi / 180 * R_EARTH * math.cos(lat0 * math.pi / 180)
+    return north, east
+
+
+class SimulatedFlight(object):
+    """ Kinematics of the mock drone above the pad.
+
+    The horizontal position is the one of `mav` (a mav_mock.Mav), so the
+    rest of the mock sees the drone move. Position setpoints are flown at up
+    to `speed` m/s, velocity setpoints are held until the next one; `wind`
+    (north, east) m/s drifts the drone all the time.
+    """
+
+    def __init__(self, mav, pad, altitude=4., yaw=0., speed=1., climb=0.5, wind=(0., 0.)):
+        self.mav = mav
+        self.pad = pad                  # lat, lon
+        self.altitude = altitude        # m above the pad
+        self.yaw = yaw                  # deg, pad rotation in the image
+        self.speed = speed
+        self.climb = climb
+        self.wind = np.asarray(wind, dtype=np.float64)
+        self.landed = False
+        self.setpoints = 0
+
+        self.__target = None            # lat, lon, altitude
+        self.__velocity = None          # north, east, down
+        self.__time = None
+
+    def goto(self, latitude, longitude, altitude):
+        self.setpoints += 1
+        self.__target = (latitude, longitude, altitude)
+        self.__velocity = None
+
+    def set_velocity(self, north, east, down):
+        self.setpoints += 1
+        self.__velocity = np.array([north, east, down], dtype=np.float64)
+        self.__target = None
+
+    def land(self):
+        self.landed = True
+
+    def offset(self):
+        """ (north, east) of the pad relative to the drone in m """
+        return position_to_offset(self.mav.pos[0], self.mav.pos[1], self.pad[0], self.pad[1])
+
+    def error(self):
+        return math.hypot(*self.offset())
+
+    def advance(self, now):
+        dt, self.__time = (0. if self.__time is None else now - self.__time), now
+        if dt <= 0. or self.landed:
+            return
+
+        move = self.wind * dt
+        if self.__target is not None:
+            north, east = position_to_offset(self.mav.pos[0], self.mav.pos[1], *self.__target[:2])
+            distance = math.hypot(north, east)
+            step = min(distance, self.speed * dt)
+            if distance > 0.:
+                move = move + np.array([north, east]) / distance * step
+            self.altitude += np.clip(self.__target[2] - self.altitude, -self.climb * dt, self.climb * dt)
+        elif self.__velocity is not None:
+            move = move + self.__velocity[:2] * dt
+            self.altitude -= self.__velocity[2] * dt
+
+        # both land in the mav's telemetry store, see telemetry.py
+        self.mav.telemetry.record('velocity', (move[0] / dt, move[1] / dt,
+                                               self.__velocity[2] if self.__velocity is not None else 0.), now)
+        self.mav.telemetry.record('position', (*offset_to_position(self.mav.pos[0], self.mav.pos[1], move[0], move[1]),
+                                               self.altitude), now)
+
+
+class SimulatedImage(np.ndarray):
+    """ A rendered frame that carries the true pad box, crops of it do as well """
+
+    def __array_finalize__(self, obj):
+        self.box = getattr(obj, 'box', None)
+
+
+class SimulatedCamera(object):
+    """ FrameGrabber interface on a SimulatedFlight.
+
+    Renders the pad as a straight down pinhole `camera` (without distortion)
+    sees it at the current offset and altitude, mounted so that image up is
+    north and image right is west (the orientation __prepare_landing
+    assumes). Stops once the drone landed or after `timeout` seconds.
+    """
+
+    def __init__(self, flight, fps=30., camera=None, timeout=60.):
+        self.flight = flight
+        self.period = 1. / fps
+        self.camera = camera if camera is not None else CameraModel.from_calib()
+        self.frame_shape = (self.camera.height, self.camera.width)
+        self.timeout = timeout
+        self.dropped = 0
+        self.grabbed = 0
+        self.last_age = 0.
+        self.render_time = 0.
+
+        self.__start = None
+        self.__next = None
+        self.__running = False
+
+    def start(self):
+        self.__start = self.__next = time.monotonic()
+        self.__running = True
+
+        return self
+
+    def stop(self):
+        self.__running = False
+
+    def is_running(self):
+        return self.__running and not self.flight.landed
+
+    def render(self):
+        h, w = self.frame_shape
+        cx, cy = self.camera.principal_point
+        px_per_m = self.camera.focal_length / self.flight.altitude
+        side = int(round(px_per_m * CALIB.REAL_WIDTH / 100.))
+        north, east = self.flight.offset()
+        center = (cx - east * px_per_m, cy - north * px_per_m)
+
+        frame, corners, _ = render_scene(self.frame_shape, max(side, 8), self.flight.yaw, center)
+        image = frame.view(SimulatedImage)
+        inside = np.all((corners >= 0) & (corners < (w, h)), axis=1)
+        image.box = pad_box(corners, frame.shape) if np.any(inside) else None
+
+        return image
+
+    def latest_nowait(self):
+        if not self.is_running():
+            return None
+
+        now = time.monotonic()
+        if now - self.__start > self.timeout:
+            logging.warning(f"simulated-camera: no landing after {self.timeout}s")
+            self.__running = False
+            return None
+        if now < self.__next:
+            return None
+
+        self.flight.advance(now)
+        start = time.perf_counter()
+        image = self.render()
+        self.render_time += time.perf_counter() - start
+
+        self.__next = max(self.__next + self.period, now)
+        self.grabbed += 1
+        return Frame(self.grabbed - 1, now, image)
+
+    async def latest(self):
+        while self.is_running():
+            frame = self.latest_nowait()
+            if frame is not None:
+                return frame
+
+            await asyncio.sleep(max(0., self.__next - time.monotonic()))
+
+        return None
+
+
+class OracleDetector(Detector):
+    """ Reports the true pad box of a SimulatedImage, `jitter` px of noise on each side """
+
+    def __init__(self, jitter=2., input_size=(320, 320), seed=None):
+        super().__init__('oracle', threshold=0.)
+        self.input_size = input_size
+        self.jitter = jitter
+        self.__rng = np.random.default_rng(seed)
+
+    def detect_roi(self, image, window):
+        # the true box is in frame coordinates already
+        return self.detect(image)
+
+    def _detect(self, image):
+        box = getattr(image, 'box', None)
+        if box is None:
+            return np.empty((0, 6))
+
+        h, w = image.shape[:2]
+        box = np.clip(np.asarray(box, dtype=np.float64) + self.__rng.normal(0., self.jitter, 4), 0, (w, h, w, h))
+        return np.array([[*box, 1., 0.]])
+
+
+class SimulatedSystem(object):
+    """ The part of mavsdk.System the landing loop uses, flying a SimulatedFlight """
+
+    class Action(object):
+        def __init__(self, flight):
+            self.flight = flight
+
+        async def goto_location(self, latitude, longitude, altitude, yaw):
+            self.flight.goto(latitude, longitude, altitude)
+
+        async def land(self):
+            self.flight.land()
+
+    class Offboard(object):
+        def __init__(self, flight):
+            self.flight = flight
+
+        async def set_velocity_ned(self, velocity):
+            self.flight.set_velocity(velocity.north_m_s, velocity.east_m_s, velocity.down_m_s)
+
+        async def start(self):
+            pass
+
+        async def stop(self):
+            pass
+
+    def __init__(self, flight):
+        self.action = SimulatedSystem.Action(flight)
+        self.offboard = SimulatedSystem.Offboard(flight)
+
+
+async def simulate_landing(mav, pad=None, altitude=4., yaw=0., wind=(0., 0.), fps=30., timeout=60.,
+                           seed=None, **kwargs):
+    """ Runs do_landing on the simulated camera until the mock drone lands (or times out).
+
+    `pad` defaults to the current position of `mav`, `kwargs` go to do_landing.
+    """
+    from landing import do_landing
+
+    flight = SimulatedFlight(mav, pad if pad is not None else list(mav.pos), altitude, yaw, wind=wind)
+    camera = SimulatedCamera(flight, fps=fps, camera=kwargs.setdefault('camera', CameraModel.from_calib()),
+                             timeout=timeout)
+    kwargs.setdefault('detector', OracleDetector(seed=seed))
+
+    start = time.monotonic()
+    stats = await do_landing(capture=camera, mavsdk_system=SimulatedSystem(flight), mav=mav, **kwargs)
+    elapsed = time.monotonic() - start
+    latency = np.asarray(stats['latency']) * 1000
+
+    return {
+        'landed': flight.landed,
+        'seconds': round(elapsed, 2),
+        'error_m': round(flight.error(), 3),
+        'frames': camera.grabbed,
+        'decisions': len(latency),
+        'setpoints': flight.setpoints,
+        'render_ms': round(camera.render_time / max(camera.grabbed, 1) * 1000, 3),
+        'latency_p50_ms': round(float(np.percentile(latency, 50)), 2) if len(latency) > 0 else None,
+    }
+
+
+def approach(seed, max_offset=1.5, timeout=60.):
+    """ One randomized approach in its own event loop, returns its simulate_landing report """
+    from mav_mock import Mav
+
+    rng = np.random.default_rng(seed)
+    mav = Mav()
+    mav.pos = list(Mav.STARTING_POS)
+    north, east = rng.uniform(-max_offset, max_offset, 2)
+    pad = list(offset_to_position(mav.pos[0], mav.pos[1], north, east))
+
+    report = asyncio.run(simulate_landing(
+        mav, pad, altitude=float(rng.uniform(3., 5.)), yaw=float(rng.uniform(-20., 20.)),
+        wind=tuple(rng.normal(0., 0.05, 2)), timeout=timeout, seed=seed))
+    return {'seed': seed, 'offset_m': round(math.hypot(north, east), 3), **report}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--approaches', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=4, help='approaches flown in parallel processes')
+    parser.add_argument('--max-offset', type=float, default=1.5, help='m between drone and pad at the start')
+    parser.add_argument('--timeout', type=float, default=60.)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    seeds = range(args.seed, args.seed + args.approaches)
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        runs = list(pool.map(approach, seeds, [args.max_offset] * len(seeds), [args.timeout] * len(seeds)))
+
+    landed = [run for run in runs if run['landed']]
+    summary = {
+        'approaches': len(runs),
+        'landed': len(landed),
+        'seconds_p50': round(float(np.median([run['seconds'] for run in landed])), 2) if landed else None,
+        'seconds_max': max((run['seconds'] for run in landed), default=None),
+        'error_m_max': max((run['error_m'] for run in landed), default=None),
+        'latency_p50_ms': round(float(np.median([run['latency_p50_ms'] for run in runs
+                                                 if run['latency_p50_ms'] is not None])), 2),
+    }
+    print(json.dumps({'summary': summary, 'runs': runs}, indent=2))
@@ -0,0 +1,259 @@
+import asyncio
+import logging
+import time
+import numpy as np
+
+
+class Stream:
+	""" The last `capacity` samples of one telemetry value, each with its time.monotonic() timestamp.
+
+	Samples are written twice, at i and i + capacity, so the history is
+	always the contiguous slice ending at the newest sample: `latest` is a
+	single index and `at` a binary search on it, nothing is allocated per
+	sample. One writer (the event loop) and any number of readers (the
+	landing stages) share a stream without a lock: a sample only becomes
+	visible once it is complete, only the oldest one may be replaced while
+	it is read.
+	"""
+
+	def __init__(self, width, capacity=256):
+		self.width = width
+		self.capacity = capacity
+		self.count = 0
+		self.__times = np.zeros(2 * capacity)
+		self.__values = np.zeros((2 * capacity, width))
+
+	def append(self, value, timestamp=None):
+		timestamp = time.monotonic() if timestamp is None else timestamp
+		i = self.count % self.capacity
+		self.__values[i] = self.__values[i + self.capacity] = value
+		self.__times[i] = self.__times[i + self.capacity] = timestamp
+		self.count += 1
+
+	def __span(self):
+		# [start, end) of the history in the doubled arrays
+		end = (self.count - 1) % self.capacity + self.capacity + 1
+		return end - min(self.count, self.capacity), end
+
+	def latest(self):
+		""" (timestamp, value) of the newest sample, None if there is none """
+		if self.count < 1:
+			return None
+
+		i = (self.count - 1) % self.capacity
+		return (self.__times[i], self.__values[i].copy())
+
+	def at(self, timestamp):
+		""" Value at `timestamp`, interpolated linearly between the samples
+		around it; before the oldest or after the newest sample that one """
+		if self.count < 1:
+			return None
+
+		start, end = self.__span()
+		times = self.__times[start:end]
+		k = int(np.searchsorted(times, timestamp, side='right'))
+		if k < 1:
+			return self.__values[start].copy()
+		if k >= len(times):
+			return self.__values[end - 1].copy()
+
+		t0, t1 = times[k - 1], times[k]
+		w = (timestamp - t0) / (t1 - t0) if t1 > t0 else 1.
+		v0, v1 = self.__values[start + k - 1], self.__values[start + k]
+		return v0 + (v1 - v0) * w
+
+	def history(self):
+		""" (timestamps, values) of all samples kept, oldest first """
+		start, end = self.__span()
+		return (self.__times[start:end].copy(), self.__values[start:end].copy())
+
+
+class Telemetry:
+	""" One Stream per telemetry value of the mav """
+	STREAMS = {
+		'position': 3,  # lat, lon, relative altitude in m
+		'velocity': 3,  # north, east, down in m/s
+		'attitude': 3,  # roll, pitch, yaw in deg
+		'battery': 1,   # remaining, 0.0 - 1.0
+	}
+
+	def __init__(self, capacity=256):
+		self.streams = {name: Stream(width, capacity) for name, width in Telemetry.STREAMS.items()}
+
+	def __getitem__(self, name):
+		return self.streams[name]
+
+	def record(self, name, value, timestamp=None):
+		self.streams[name].append(value, timestamp)
+
+	def latest(self, name):
+		sample = self.streams[name].latest()
+		return sample[1] if sample is not None else None
+
+	def at(self, name, timestamp):
+		return self.streams[name].at(timestamp)
+
+
+class Subscription:
+	""" A mavsdk telemetry stream: its rate setter, the Telemetry stream it
+	feeds (through `sample`, which turns a message into its row) and the
+	MAVLink message it mostly arrives as, for the bandwidth estimate """
+
+	def __init__(self, stream, setter=None, store=None, sample=None, message_bytes=0):
+		self.stream = stream
+		self.setter = setter
+		self.store = store
+		self.sample = sample
+		self.message_bytes = message_bytes  # MAVLink v2 on the wire, header and checksum included
+
+
+class Subscriptions:
+	""" Declarative telemetry of a mavsdk.System over a slow serial link.
+
+	SUBSCRIPTIONS says what is read, PROFILES at which rates (Hz, 0 stops a
+	stream where the autopilot allows it; streams without a setter come at
+	the autopilot's rate). `apply` sets the rates of a profile and warns if
+	they do not fit into `budget` of the link; `run` reads every stream,
+	records it into the Telemetry store and fans each message out to all
+	`listen`ers, a stream that fails is resubscribed without stopping the
+	others. `stats` reports messages and estimated bytes per second per
+	stream, from message counts and sizes (mavsdk does not expose the bytes).
+	"""
+	SUBSCRIPTIONS = {
+		'position': Subscription('position', 'set_rate_position', 'position',
+								lambda v: (v.latitude_deg, v.longitude_deg, v.relative_altitude_m), 40),
+		'velocity': Subscription('velocity_ned', 'set_rate_velocity_ned', 'velocity',
+								lambda v: (v.north_m_s, v.east_m_s, v.down_m_s), 40),
+		'attitude': Subscription('attitude_euler', 'set_rate_attitude', 'attitude',
+								lambda v: (v.roll_deg, v.pitch_deg, v.yaw_deg), 40),
+		'battery': Subscription('battery', 'set_rate_battery', 'battery',
+								lambda v: (v.remaining_percent,), 48),
+		'in_air': Subscription('in_air', 'set_rate_in_air', None, None, 14),
+		'gps_info': Subscription('gps_info', 'set_rate_gps_info', None, None, 42),
+		'health': Subscription('health', None, None, None, 43),
+		'status_text': Subscription('status_text', None, None, None, 63),
+	}
+	PROFILES = {
+		'idle': {'position': 0.5, 'velocity': 0., 'attitude': 0., 'battery': 0.2, 'in_air': 0.5, 'gps_info': 0.2},
+		'mission': {'position': 2., 'velocity': 1., 'attitude': 1., 'battery': 1., 'in_air': 2., 'gps_info': 0.5},
+		'landing': {'position': 20., 'velocity': 20., 'attitude': 20., 'battery': 0.5, 'in_air': 2., 'gps_info': 0.2},
+	}
+	# SERIAL0 of the autopilot at 57600 baud, 10 bits per byte
+	LINK_BYTES = 5760
+	# share of the link telemetry may use, the rest is for missions and setpoints
+	BUDGET = 0.5
+	# s before resubscribing to a failed stream, doubled up to RETRY_MAX while it keeps failing
+	RETRY = 1.
+	RETRY_MAX = 30.
+
+	def __init__(self, system, store, names=None):
+		self.system = system
+		self.store = store
+		self.names = list(names) if names is not None else list(Subscriptions.SUBSCRIPTIONS)
+		self.profile = None
+		self.rates = {}
+		self.last = {}
+
+		self.__listeners = {name: [] for name in self.names}
+		self.__messages = dict.fromkeys(self.names, 0)
+		self.__since = time.monotonic()
+
+	@staticmethod
+	def bandwidth(rates):
+		""" Estimated bytes per second of streams at `rates` """
+		return sum(rate * Subscriptions.SUBSCRIPTIONS[name].message_bytes for name, rate in rates.items())
+
+	async def apply(self, profile):
+		rates = Subscriptions.PROFILES[profile]
+		if self.profile is not None:
+			logging.info(f"telemetry: {self.stats()}")
+		if Subscriptions.bandwidth(rates) > Subscriptions.BUDGET * Subscriptions.LINK_BYTES:
+			logging.warning(f"telemetry: profile {profile} needs {Subscriptions.bandwidth(rates):.0f}B/s, "
+							f"over the budget of {Subscriptions.BUDGET * Subscriptions.LINK_BYTES:.0f}B/s")
+
+		changes = {}
+		for name, rate in rates.items():
+			if name not in self.names or self.rates.get(name) == rate:
+				continue
+			setter = getattr(self.system.telemetry, Subscriptions.SUBSCRIPTIONS[name].setter, None)
+			if setter is None:
+				logging.warning(f"telemetry: no rate setter for {name}")
+				continue
+			changes[name] = setter(rate)
+
+		# one round trip over the link for all of them; a rate the autopilot refuses leaves the others set
+		results = await asyncio.gather(*changes.values(), return_exceptions=True)
+		for name, result in zip(changes, results):
+			if isinstance(result, Exception):
+				logging.warning(f"telemetry: {name} rate {rates[name]} not set: {result!r}")
+			else:
+				self.rates[name] = rates[name]
+
+		self.profile = profile
+		self.reset()
+		logging.info(f"telemetry: profile {profile}, {Subscriptions.bandwidth(rates):.0f}B/s")
+
+	def listen(self, name, maxsize=1):
+		""" Queue that gets every message of stream `name`; when full, the oldest one is dropped """
+		queue = asyncio.Queue(maxsize)
+		self.__listeners[name].append(queue)
+
+		return queue
+
+	def unlisten(self, name, queue):
+		self.__listeners[name].remove(queue)
+
+	def __publish(self, name, value):
+		subscription = Subscriptions.SUBSCRIPTIONS[name]
+		self.__messages[name] += 1
+		self.last[name] = value
+		if subscription.store is not None:
+			self.store.record(subscription.store, subscription.sample(value))
+
+		for queue in self.__listeners[name]:
+			if queue.full():
+				queue.get_nowait()
+			queue.put_nowait(value)
+
+	async def __read(self, name):
+		count = 0
+		async for value in getattr(self.system.telemetry, Subscriptions.SUBSCRIPTIONS[name].stream)():
+			self.__publish(name, value)
+			count += 1
+
+		return count
+
+	async def __supervise(self, name):
+		# a failing stream is resubscribed on its own, the others keep running
+		retry = Subscriptions.RETRY
+		while True:
+			try:
+				if await self.__read(name) > 0:
+					retry = Subscriptions.RETRY
+				logging.warning(f"telemetry: {name} stream ended, resubscribing in {retry:g}s")
+			except Exception as e:
+				logging.warning(f"telemetry: {name} stream failed ({e!r}), resubscribing in {retry:g}s")
+			await asyncio.sleep(retry)
+			retry = min(retry * 2., Subscriptions.RETRY_MAX)
+
+	async def run(self):
+		await asyncio.gather(*[self.__supervise(name) for name in self.names])
+
+	def reset(self):
+		self.__messages = dict.fromkeys(self.names, 0)
+		self.__since = time.monotonic()
+
+	def stats(self):
+		""" Per stream since the last profile change: requested rate, measured rate and bytes per second """
+		elapsed = max(time.monotonic() - self.__since, 1e-9)
+		report = {}
+		for name in self.names:
+			hz = self.__messages[name] / elapsed
+			report[name] = {
+				'rate_hz': self.rates.get(name),
+				'measured_hz': round(hz, 2),
+				'bytes_per_s': round(hz * Subscriptions.SUBSCRIPTIONS[name].message_bytes, 1),
+			}
+
+		return {'profile': self.profile, 'streams': report,
+				'bytes_per_s': round(sum(s['bytes_per_s'] for s in report.values()), 1)}
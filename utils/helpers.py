@@ -1,7 +1,13 @@
 import numpy as np
 import sys
 
-from pycoral.adapters import detect
+from collections import namedtuple
+
+try:
+    from pycoral.adapters.detect import BBox
+except ImportError:
+    # same field order as pycoral's, landing runs without a Coral as well
+    BBox = namedtuple('BBox', ['xmin', 'ymin', 'xmax', 'ymax'])
 
 
 class CALIB:
@@ -24,10 +30,12 @@ def calculate_distance(focal_length, real_width, reference_width):
 
 
 def arr_to_bbox(arr):
-    return detect.BBox(xmin=arr[0], ymin=arr[1], xmax=arr[2], ymax=arr[3])
+    return BBox(xmin=arr[0], ymin=arr[1], xmax=arr[2], ymax=arr[3])
 
 
 def calculate_centroid(vertexes):
+     # accepts OpenCV contours, shaped (N, 1, 2), as well as (N, 2) arrays
+     vertexes = np.asarray(vertexes).reshape(-1, 2)
      _x_list = [vertex [0] for vertex in vertexes]
      _y_list = [vertex [1] for vertex in vertexes]
      _len = len(vertexes)
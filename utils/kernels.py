@@ -0,0 +1,244 @@
+"""
+Geometric kernels of the tracker, compiled with numba where it is installed.
+
+The kernels are compiled for fixed signatures into numba's on-disk cache
+(next to this file), so they are built once before the first flight:
+
+$ python3 -m utils.kernels
+
+After that, importing this module loads the machine code from the cache,
+nothing is compiled while the drone is landing. Without numba, the same
+functions run as plain NumPy.
+"""
+import logging
+import time
+import numpy as np
+
+__started = time.perf_counter()
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+def __jit(signature):
+    # compiled eagerly for one signature, with NumPy's float semantics
+    # (nan / inf instead of ZeroDivisionError)
+    return njit(signature, cache=True, error_model='numpy')
+
+
+def __overlap(ax1, ay1, ax2, ay2, bx1, by1, bx2, by2):
+    # same arithmetic as iou_tracker: float32 boxes, float64 intersection
+    w = max(0., min(ax2, bx2) - max(ax1, bx1))
+    h = max(0., min(ay2, by2) - max(ay1, by1))
+    wh = w * h
+    return wh / ((ax2 - ax1) * (ay2 - ay1) + (bx2 - bx1) * (by2 - by1) - wh)
+
+
+if njit is not None:
+    __overlap = __jit('float64(float32, float32, float32, float32, float32, float32, float32, float32)')(__overlap)
+
+
+def __iou_matrix(bb_test, bb_gt):
+    iou = np.zeros((bb_test.shape[0], bb_gt.shape[0]), dtype=np.float64)
+    for i in range(bb_test.shape[0]):
+        for j in range(bb_gt.shape[0]):
+            iou[i, j] = __overlap(bb_test[i, 0], bb_test[i, 1], bb_test[i, 2], bb_test[i, 3],
+                                  bb_gt[j, 0], bb_gt[j, 1], bb_gt[j, 2], bb_gt[j, 3])
+    return iou
+
+
+def __suppress(boxes, active):
+    # boxes: [x1, y1, x2, y2, objID, is_update(0,1), labelID] as float32,
+    # returns 1 for the boxes motion.Tracker.hide_boxes keeps
+    num_objects = boxes.shape[0]
+    flags = np.ones(num_objects, dtype=np.uint8)
+
+    for idx_a in range(num_objects):
+        for idx_b in range(idx_a + 1, num_objects):
+            if flags[idx_b] == 0:
+                continue
+
+            if active:
+                # If A include B, and B is predicted then delete B
+                if (boxes[idx_a, 0] <= boxes[idx_b, 0]) and (boxes[idx_a, 1] <= boxes[idx_b, 1]) and (
+                    boxes[idx_a, 2] >= boxes[idx_b, 2]) and (boxes[idx_a, 3] >= boxes[idx_b, 3]) and (
+                        boxes[idx_b, 5] == 0):
+                    flags[idx_b] = 0
+                    continue
+                # B inlcude A, and A is predicted tehn delete A
+                elif (boxes[idx_a, 0] >= boxes[idx_b, 0]) and (boxes[idx_a, 1] >= boxes[idx_b, 1]) and (
+                    boxes[idx_a, 2] <= boxes[idx_b, 2]) and (boxes[idx_a, 3] <= boxes[idx_b, 3]) and (
+                        boxes[idx_a, 5] == 0):
+                    flags[idx_a] = 0
+                    break
+
+            iou = __overlap(boxes[idx_a, 0], boxes[idx_a, 1], boxes[idx_a, 2], boxes[idx_a, 3],
+                            boxes[idx_b, 0], boxes[idx_b, 1], boxes[idx_b, 2], boxes[idx_b, 3])
+            if iou >= 0.3:
+                if boxes[idx_a, 5] == 0:  # (false, false) and (false, true)
+                    flags[idx_a] = 0
+                    break
+                elif boxes[idx_b, 5] == 0:  # (true, false)
+                    flags[idx_b] = 0
+                    continue
+                else:  # (true, true)
+                    flags[idx_a] = 0
+                    break
+
+    return flags
+
+
+def __bbox_to_z(boxes):
+    z = np.empty((boxes.shape[0], 4), dtype=np.float64)
+    for i in range(boxes.shape[0]):
+        w = boxes[i, 2] - boxes[i, 0]
+        h = boxes[i, 3] - boxes[i, 1]
+        z[i, 0] = boxes[i, 0] + w / 2
+        z[i, 1] = boxes[i, 1] + h / 2
+        z[i, 2] = w * h
+        z[i, 3] = w / h
+    return z  # center_x, center_y, area, ratio
+
+
+def __x_to_bbox(x):
+    boxes = np.empty((x.shape[0], 4), dtype=np.float64)
+    for i in range(x.shape[0]):
+        w = np.sqrt(x[i, 2] * x[i, 3])
+        h = x[i, 2] / w
+        boxes[i, 0] = x[i, 0] - w / 2.
+        boxes[i, 1] = x[i, 1] - h / 2.
+        boxes[i, 2] = x[i, 0] + w / 2.
+        boxes[i, 3] = x[i, 1] + h / 2.
+    return boxes  # x1, y1, x2, y2
+
+
+def __size_mask(boxes, min_w, min_h):
+    keep = np.empty(boxes.shape[0], dtype=np.bool_)
+    for i in range(boxes.shape[0]):
+        keep[i] = (boxes[i, 2] - boxes[i, 0] >= min_w) and (boxes[i, 3] - boxes[i, 1] >= min_h)
+    return keep
+
+
+def __iou_matrix_numpy(bb_test, bb_gt):
+    bb_test, bb_gt = bb_test[:, None, :], bb_gt[None, :, :]
+    w = np.maximum(0., np.minimum(bb_test[..., 2], bb_gt[..., 2]) - np.maximum(bb_test[..., 0], bb_gt[..., 0]))
+    h = np.maximum(0., np.minimum(bb_test[..., 3], bb_gt[..., 3]) - np.maximum(bb_test[..., 1], bb_gt[..., 1]))
+    wh = w.astype(np.float64) * h
+    return wh / ((bb_test[..., 2] - bb_test[..., 0]) * (bb_test[..., 3] - bb_test[..., 1]) + (
+            bb_gt[..., 2] - bb_gt[..., 0]) * (bb_gt[..., 3] - bb_gt[..., 1]) - wh)
+
+
+def suppress_matrix(detections, active=True):
+    """ Keep-flags of Tracker.hide_boxes from pairwise outcome matrices.
+
+    For every pair a < b the outcome of the suppression loop only depends on
+    the two boxes: b dies, a dies (and the row of a ends) or nothing. The
+    outcomes are computed for all pairs at once, then each row a kills the
+    b's still alive up to the first one that kills a.
+    """
+    boxes = np.asarray(detections, dtype=np.float32)
+    num_objects = len(boxes)
+    a, b = boxes[:, None, :], boxes[None, :, :]
+    predicted_a, predicted_b = a[..., 5] == 0, b[..., 5] == 0
+
+    a_holds_b = np.all(a[..., :2] <= b[..., :2], axis=-1) & np.all(a[..., 2:4] >= b[..., 2:4], axis=-1)
+    b_holds_a = np.all(a[..., :2] >= b[..., :2], axis=-1) & np.all(a[..., 2:4] <= b[..., 2:4], axis=-1)
+    contains_b = active & a_holds_b & predicted_b
+    contains_a = active & ~contains_b & b_holds_a & predicted_a
+    with np.errstate(invalid='ignore', divide='ignore'):  # empty boxes, nan never overlaps
+        overlap = ~contains_b & ~contains_a & (__iou_matrix_numpy(boxes, boxes) >= 0.3)
+    only_b_predicted = ~predicted_a & predicted_b
+
+    later = np.triu(np.ones((num_objects, num_objects), dtype=bool), k=1)
+    kill_b = later & (contains_b | (overlap & only_b_predicted))
+    kill_a = later & (contains_a | (overlap & ~only_b_predicted))
+
+    flags = np.ones(num_objects, dtype=np.uint8)
+    alive = flags.view(bool)
+    for idx_a in range(num_objects):
+        stop = np.flatnonzero(alive & kill_a[idx_a])
+        end = stop[0] if len(stop) > 0 else num_objects
+        alive[:end] &= ~kill_b[idx_a, :end]
+        if len(stop) > 0:
+            alive[idx_a] = False
+
+    return flags
+
+
+def __bbox_to_z_numpy(boxes):
+    w = boxes[:, 2] - boxes[:, 0]
+    h = boxes[:, 3] - boxes[:, 1]
+    return np.column_stack((boxes[:, 0] + w / 2, boxes[:, 1] + h / 2, w * h, w / h))
+
+
+def __x_to_bbox_numpy(x):
+    w = np.sqrt(x[:, 2] * x[:, 3])
+    h = x[:, 2] / w
+    return np.column_stack((x[:, 0] - w / 2., x[:, 1] - h / 2., x[:, 0] + w / 2., x[:, 1] + h / 2.))
+
+
+def __size_mask_numpy(boxes, min_w, min_h):
+    return (boxes[:, 2] - boxes[:, 0] >= min_w) & (boxes[:, 3] - boxes[:, 1] >= min_h)
+
+
+if njit is not None:
+    __iou_matrix = __jit('float64[:, :](float32[:, :], float32[:, :])')(__iou_matrix)
+    __suppress = __jit('uint8[:](float32[:, :], boolean)')(__suppress)
+    __bbox_to_z = __jit('float64[:, :](float64[:, :])')(__bbox_to_z)
+    __x_to_bbox = __jit('float64[:, :](float64[:, :])')(__x_to_bbox)
+    __size_mask = __jit('boolean[:](float64[:, :], float64, float64)')(__size_mask)
+else:
+    __iou_matrix = __iou_matrix_numpy
+    __suppress = suppress_matrix
+    __bbox_to_z = __bbox_to_z_numpy
+    __x_to_bbox = __x_to_bbox_numpy
+    __size_mask = __size_mask_numpy
+
+load_time = time.perf_counter() - __started  # compiling or loading the cache
+
+
+def iou_matrix(bb_test, bb_gt):
+    """ IoU of every box in bb_test (N, 4+) against every box in bb_gt (M, 4+) """
+    return __iou_matrix(np.asarray(bb_test, dtype=np.float32)[:, :4],
+                        np.asarray(bb_gt, dtype=np.float32)[:, :4])
+
+
+def suppress(detections, active=True):
+    """ Keep-flags of Tracker.hide_boxes for (N, 7) [x1, y1, x2, y2, objID, is_update, labelID] rows """
+    return __suppress(np.asarray(detections, dtype=np.float32), bool(active))
+
+
+def bbox_to_z(boxes):
+    """ (N, 4+) [x1, y1, x2, y2] boxes to (N, 4) [center_x, center_y, area, ratio] """
+    return __bbox_to_z(np.asarray(boxes, dtype=np.float64)[:, :4])
+
+
+def x_to_bbox(x):
+    """ (N, 4+) filter states [center_x, center_y, area, ratio, ...] to (N, 4) boxes """
+    return __x_to_bbox(np.asarray(x, dtype=np.float64)[:, :4])
+
+
+def size_mask(boxes, min_w, min_h):
+    """ True for the (N, 4+) boxes at least min_w wide and min_h high """
+    return __size_mask(np.asarray(boxes, dtype=np.float64).reshape(len(boxes), -1), float(min_w), float(min_h))
+
+
+def warmup():
+    """ Runs every kernel once, returns the seconds it took """
+    start = time.perf_counter()
+    boxes = np.array([[0, 0, 10, 10, 1, 1, 0], [2, 2, 8, 8, 2, 0, 0]], dtype=np.float64)
+    iou_matrix(boxes, boxes)
+    suppress(boxes)
+    x_to_bbox(bbox_to_z(boxes))
+    size_mask(boxes, 1., 1.)
+
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    logging.getLogger().setLevel(logging.INFO)
+    if njit is None:
+        logging.warning("numba is not installed, the kernels run as plain NumPy")
+    logging.info(f"tracking kernels loaded in {load_time:.3f}s, first run took {warmup() * 1e3:.2f}ms")
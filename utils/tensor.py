@@ -0,0 +1,62 @@
+import numpy as np
+import cv2
+
+
+class InputTensor(object):
+    """ Writes camera frames straight into the interpreter's input tensor.
+
+    The frame is resized (keeping its aspect ratio, like
+    `pycoral.adapters.common.set_resized_input`) into the top left corner of
+    the tensor, so no intermediate image is allocated per frame. The channels
+    are fed in the camera's BGR order the model was run on, `swap_rb` converts
+    them to RGB in place. The padding is zeroed once per frame size.
+
+    Float models get the frame resized into a scratch buffer first and
+    normalized into the tensor as (pixel - mean) / std, cv2 only writes into
+    a destination of the source's type.
+    """
+
+    def __init__(self, interpreter, swap_rb=False, mean=127.5, std=127.5):
+        detail = interpreter.get_input_details()[0]
+        _, self.height, self.width, _ = detail['shape']
+        if detail['dtype'] not in (np.uint8, np.float32):
+            raise ValueError(f"unsupported input tensor type {np.dtype(detail['dtype']).name}, expected uint8 or float32")
+        self.swap_rb = swap_rb
+        self.mean = mean
+        self.std = std
+        self.scale = None
+        self.size = None
+
+        self.__index = detail['index']
+        self.__interpreter = interpreter
+        self.__frame_shape = None
+        self.__scratch = None if detail['dtype'] == np.uint8 else np.empty((self.height, self.width, 3), np.uint8)
+
+    def __tensor(self):
+        return self.__interpreter.tensor(self.__index)()[0]
+
+    def __prepare(self, frame_shape):
+        scale = min(self.width / frame_shape[1], self.height / frame_shape[0])
+        self.size = (int(frame_shape[1] * scale), int(frame_shape[0] * scale))
+        self.scale = (scale, scale)
+        self.__frame_shape = frame_shape
+
+        # black in the tensor's units
+        self.__tensor().fill(0 if self.__scratch is None else -self.mean / self.std)
+
+    def set(self, image):
+        """ Resizes `image` into the input tensor and returns the scale for `detect.get_objects` """
+        if image.shape != self.__frame_shape:
+            self.__prepare(image.shape)
+
+        view = self.__tensor()[:self.size[1], :self.size[0]]
+        resized = view if self.__scratch is None else self.__scratch[:self.size[1], :self.size[0]]
+        cv2.resize(image, self.size, dst=resized, interpolation=cv2.INTER_AREA)
+        if self.swap_rb:
+            cv2.cvtColor(resized, cv2.COLOR_BGR2RGB, dst=resized)
+        if self.__scratch is not None:
+            np.subtract(resized, self.mean, out=view, dtype=np.float32)
+            view /= self.std
+        del view  # the interpreter refuses to run while views on its buffers exist
+
+        return self.scale
@@ -1,6 +1,7 @@
 import numpy as np
 
 from scipy.optimize import linear_sum_assignment
+from utils.kernels import iou_matrix
 
 
 def iou_tracker(bb_test_, bb_gt_):
@@ -19,6 +20,11 @@ def iou_tracker(bb_test_, bb_gt_):
     return iou
 
 
+def iou_batch(bb_test, bb_gt):
+    """ IoU of every box in bb_test (N, 4+) against every box in bb_gt (M, 4+), shape (N, M) """
+    return iou_matrix(bb_test, bb_gt)
+
+
 def convert_bbox_to_z(bbox):
     w = bbox[2] - bbox[0]
     h = bbox[3] - bbox[1]
@@ -45,54 +51,33 @@ def convert_x_to_bbox(x, score=None):
 
 
 def linear_assignment(matrix):
-    indices = linear_sum_assignment(matrix)
     if len(matrix) < 1:
         return np.empty((0, 2), dtype=np.int64)
-    
-    return np.array([
-        [
-            indices[0][0], 
-            indices[1][0]
-        ]
-    ])
+
+    # every (row, column) pair of the optimal assignment
+    return np.column_stack(linear_sum_assignment(matrix)).astype(np.int64)
 
 
 def associate(detections, trackers, iou_threshold=0.3):
     if len(trackers) == 0:
         return np.empty((0, 2), dtype=int), np.arange(len(detections)), np.empty((0, 5), dtype=int)
+    if len(detections) == 0:
+        return np.empty((0, 2), dtype=int), np.empty((0,), dtype=int), np.arange(len(trackers))
 
-    iou_matrix = np.zeros((len(detections), len(trackers)), dtype=np.float32)
-
-    for d, det in enumerate(detections):
-        for t, trk in enumerate(trackers):
-            iou_matrix[d, t] = iou_tracker(trk, det)
+    iou = iou_batch(detections, trackers)
 
     # Solve the linear assignment problem using the Hungarian algorithm
     # The problem is also known as maximum weight matching in bipartite graphs. The method is also known as the
     # Munkres or Kuhn-Munkres algorithm.
-    matched_indices = linear_assignment(-iou_matrix)
-
-    unmatched_detections = []
-    for d, det in enumerate(detections):
-        if d not in matched_indices[:, 0]:
-            unmatched_detections.append(d)  # store index
-
-    unmatched_trackers = []
-    for t, trk in enumerate(trackers):
-        if t not in matched_indices[:, 1]:
-            unmatched_trackers.append(t)  # store index
-
-    matches = []
-    for m in matched_indices:
-        if iou_matrix[m[0], m[1]] < iou_threshold:
-            unmatched_detections.append(m[0])
-            unmatched_trackers.append(m[1])
-        else:
-            matches.append(m.reshape(1, 2))
-
-    if len(matches) == 0:
-        matches = np.empty((0, 2), dtype=int)
-    else:
-        matches = np.concatenate(matches, axis=0)
+    matched_indices = linear_assignment(-iou)
+
+    # pairs below the threshold are no match, both sides stay unmatched
+    valid = iou[matched_indices[:, 0], matched_indices[:, 1]] >= iou_threshold
+    matches = matched_indices[valid]
+
+    unmatched_detections = np.ones(len(detections), dtype=bool)
+    unmatched_detections[matches[:, 0]] = False
+    unmatched_trackers = np.ones(len(trackers), dtype=bool)
+    unmatched_trackers[matches[:, 1]] = False
 
-    return matches, np.array(unmatched_detections), np.array(unmatched_trackers)
\ No newline at end of file
+    return matches, np.flatnonzero(unmatched_detections), np.flatnonzero(unmatched_trackers)
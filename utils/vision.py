@@ -1,5 +1,6 @@
 import numpy as np
 import imutils
+import threading
 import math
 import cv2
 
@@ -7,15 +8,18 @@ from utils.drawing import draw_polygon
 from utils.helpers import clip_value, calculate_centroid
 
 
-def __extract_corners(gray_image, base):
+def __extract_corners(gray_image, base, scale=1.):
+    # base may come from a copy of gray_image that was downscaled by scale
     hull = cv2.convexHull(base)
     epsl = 0.07 * cv2.arcLength(base, True)
     hull = cv2.approxPolyDP(hull, epsl, True)
-    hull = np.float32(hull)
+    hull = np.float32(hull) / scale
 
+    # the search window has to cover the rounding error of the coarse corners
+    win = max(5, int(math.ceil(3. / scale)))
     method = cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT
     criteria = (method, 1000, 1e-4)
-    cv2.cornerSubPix(gray_image, hull, (5, 5), (-1, -1), criteria)
+    cv2.cornerSubPix(gray_image, hull, (win, win), (-1, -1), criteria)
     
     corners = [pt[0] for pt in hull]
        # OBJECTIVE: Find top-right corner and use to label corners
@@ -44,6 +48,36 @@ def __extract_contours(binary_image):
     return (True, max(contours, key=cv2.contourArea))
 
 
+class RectifiedPad(object):
+    """ Perspective corrected image of the pad, only warped when asked for.
+
+    Most frames only need the pad's size and center; the warp is done on the
+    first call to `warp` and cached. `out` may be a reusable buffer of
+    `shape`, which is then warped into instead of allocating a new image.
+    """
+    __slots__ = ('roi', 'homography', 'size', '_image')
+
+    def __init__(self, roi, homography, size):
+        self.roi = roi
+        self.homography = homography
+        self.size = size  # (width, height)
+        self._image = None
+
+    @property
+    def shape(self):
+        return (self.size[1], self.size[0]) + self.roi.shape[2:]
+
+    def warp(self, out=None):
+        if self._image is not None:
+            return self._image
+
+        if out is not None and (out.shape != self.shape or out.dtype != self.roi.dtype):
+            out = None
+        self._image = cv2.warpPerspective(self.roi, self.homography, self.size, dst=out)
+
+        return self._image
+
+
 def __associate(roi, box, corners):
     w0 = max(abs(corners[2][0] - corners[3][0]), 
              abs(corners[1][0] - corners[0][0]))  
@@ -59,10 +93,15 @@ def __associate(roi, box, corners):
 
     corners_pp = np.float32([[0, 0], [0, h], [w, h], [w, 0]])
     homogrm, _ = cv2.findHomography(corners, corners_pp)
+    size = (int(math.ceil(w)), int(math.ceil(h)))
 
-    subject = cv2.warpPerspective(roi, homogrm, (int(math.ceil(w)), int(math.ceil(h))))
     if do_flip:
-        subject = cv2.flip(subject, -1)
+        # rotating the warped image by 180 degrees is part of the same warp
+        homogrm = np.array([[-1., 0., size[0] - 1.],
+                            [0., -1., size[1] - 1.],
+                            [0., 0., 1.]]) @ homogrm
+
+    subject = RectifiedPad(roi, homogrm, size)
     
     transfered = np.float32(
         [
@@ -88,19 +127,255 @@ def __locate(contour):
     return (cx, cy)
 
 
+class FingerprintDecoder(object):
+    """ Decodes the IDs on the landing pad, keeping state between frames.
+
+    The ArUco dictionary and detector parameters are built once. Per track,
+    the decoded IDs are remembered together with the pad geometry (center
+    and size) they were decoded at; once the same IDs were read
+    `confirmations` times in a row, they are handed out without decoding as
+    long as the pad has not moved or scaled by more than `tolerance` of its
+    size since the last actual decode.
+    """
+
+    def __init__(self, confirmations=2, tolerance=0.15, refine=False):
+        self.confirmations = confirmations
+        self.tolerance = tolerance
+        self.hits = 0
+        self.misses = 0
+
+        self.__dictionary = cv2.aruco.Dictionary_get(cv2.aruco.DICT_6X6_250)
+        self.__parameters = cv2.aruco.DetectorParameters_create()
+        # the IDs do not depend on subpixel accurate marker corners
+        self.__parameters.cornerRefinementMethod = (
+            cv2.aruco.CORNER_REFINE_SUBPIX if refine else cv2.aruco.CORNER_REFINE_NONE)
+        self.__tracks = {}  # track id -> [ids, center, dim, confirmed reads]
+        self.__buffers = threading.local()
+
+    def __unchanged(self, entry, center, dim):
+        _, center0, dim0, _ = entry
+        if center is None or dim is None or not dim0:
+            return False
+
+        shift = math.hypot(center[0] - center0[0], center[1] - center0[1])
+        return (shift <= self.tolerance * dim0) and (abs(dim - dim0) <= self.tolerance * dim0)
+
+    def __warp(self, subject):
+        # one reusable buffer per estimation worker thread
+        buffer = getattr(self.__buffers, 'image', None)
+        image = subject.warp(out=buffer)
+        self.__buffers.image = image
+
+        return image
+
+    def __cached(self, track_id, center, dim):
+        entry = self.__tracks.get(track_id)
+        if entry is not None and entry[3] >= self.confirmations and self.__unchanged(entry, center, dim):
+            return entry[0]
+
+        return None
+
+    def __remember(self, track_id, ids, center, dim):
+        if track_id is None:
+            return
+
+        entry = self.__tracks.get(track_id)
+        if len(ids) < 1:
+            self.__tracks.pop(track_id, None)
+        elif entry is not None and np.array_equal(np.sort(entry[0], axis=None), np.sort(ids, axis=None)):
+            self.__tracks[track_id] = [ids, center, dim, entry[3] + 1]
+        else:
+            self.__tracks[track_id] = [ids, center, dim, 1]
+
+    def __box_parameters(self, min_perimeter_rate):
+        # per thread, the rate depends on the boxes of the call
+        parameters = getattr(self.__buffers, 'parameters', None)
+        if parameters is None:
+            parameters = cv2.aruco.DetectorParameters_create()
+            parameters.cornerRefinementMethod = self.__parameters.cornerRefinementMethod
+            self.__buffers.parameters = parameters
+        parameters.minMarkerPerimeterRate = max(min(min_perimeter_rate, 4.), 0.03)
+
+        return parameters
+
+    def decode(self, source_image, track_id=None, center=None, dim=None):
+        """ `source_image` is an image or a RectifiedPad, which is only warped if needed """
+        ids = self.__cached(track_id, center, dim)
+        if ids is not None:
+            self.hits += 1
+            return ids
+
+        self.misses += 1
+        if isinstance(source_image, RectifiedPad):
+            source_image = self.__warp(source_image)
+        _, ids, _ = cv2.aruco.detectMarkers(source_image, self.__dictionary,
+                                parameters=self.__parameters)
+        ids = [] if ids is None else ids
+        self.__remember(track_id, ids, center, dim)
+
+        return ids
+
+    @staticmethod
+    def __groups(boxes, indices, margin=0.1):
+        # indices of boxes that overlap or touch (within margin of their size), transitively
+        size = boxes[indices, 2:] - boxes[indices, :2]
+        grown = np.hstack((boxes[indices, :2] - size * margin, boxes[indices, 2:] + size * margin))
+        touching = np.all((grown[:, None, :2] <= grown[None, :, 2:]) & (grown[None, :, :2] <= grown[:, None, 2:]), axis=2)
+
+        groups, seen = [], set()
+        for k in range(len(indices)):
+            if k in seen:
+                continue
+            group, stack = [], [k]
+            seen.add(k)
+            while stack:
+                j = stack.pop()
+                group.append(indices[j])
+                for n in np.flatnonzero(touching[j]):
+                    if n not in seen:
+                        seen.add(n)
+                        stack.append(n)
+            groups.append(sorted(group))
+
+        return groups
+
+    def __detect(self, source_image, boxes, group, coarse_size):
+        # markers in the union of the boxes in group: ids (M, 1) and centers (M, 2) in frame coordinates
+        h, w = source_image.shape[:2]
+        dim = (boxes[group, 2] - boxes[group, 0]).min()
+        x1, y1 = np.maximum(np.floor(boxes[group, :2].min(axis=0)), 0).astype(int)
+        x2, y2 = np.minimum(np.ceil(boxes[group, 2:].max(axis=0)), (w, h)).astype(int)
+        if x2 <= x1 or y2 <= y1:
+            # coasting tracks may drift off the frame, nothing to search
+            return np.empty((0, 1), dtype=np.int32), np.empty((0, 2))
+        image = source_image[y1:y2, x1:x2]
+        if image.ndim > 2:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        scale = 1.
+        if coarse_size and dim > coarse_size:
+            scale = coarse_size / dim
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+        corners, ids, _ = cv2.aruco.detectMarkers(image, self.__dictionary,
+                                parameters=self.__box_parameters(0.25 * dim * scale / max(image.shape)))
+        if ids is None:
+            return np.empty((0, 1), dtype=np.int32), np.empty((0, 2))
+
+        return ids, np.array([c.reshape(-1, 2).mean(axis=0) for c in corners]) / scale + (x1, y1)
+
+    def decode_boxes(self, source_image, boxes, track_ids=None, coarse_size=None):
+        """ IDs on each of the pads in `boxes` (x1, y1, x2, y2 rows).
+
+        Tracks with cached IDs are handed out as in `decode`, with the box
+        center and width standing in for the pad geometry. The other boxes
+        are searched in groups of boxes that overlap or touch: the union of
+        a group is converted to gray and searched once, every marker goes to
+        the boxes its center lies in. Pads apart from each other are searched
+        on their own crops, the ground between them is never looked at. With
+        `coarse_size` set, a group is downscaled so that its smallest box is
+        `coarse_size` pixels wide.
+
+        Markers smaller than a quarter of the smallest box (in perimeter) are
+        not looked for, on noisy ground most of the search time goes into
+        such candidates.
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        track_ids = track_ids if track_ids is not None else [None] * len(boxes)
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2.
+        dims = boxes[:, 2] - boxes[:, 0]
+
+        fingerprints = [self.__cached(track_id, tuple(centers[i]), dims[i]) for i, track_id in enumerate(track_ids)]
+        pending = [i for i, ids in enumerate(fingerprints) if ids is None]
+        self.hits += len(boxes) - len(pending)
+        self.misses += len(pending)
+        if len(pending) < 1:
+            return fingerprints
+
+        for group in FingerprintDecoder.__groups(boxes, pending):
+            ids, marker_centers = self.__detect(source_image, boxes, group, coarse_size)
+            for i in group:
+                inside = np.all((marker_centers >= boxes[i, :2]) & (marker_centers < boxes[i, 2:]), axis=1)
+                fingerprints[i] = ids[inside]
+                self.__remember(track_ids[i], fingerprints[i], tuple(centers[i]), dims[i])
+
+        return fingerprints
+
+    def forget(self, track_ids):
+        """ Drops the cached IDs of every track not in `track_ids` """
+        for track_id in [t for t in list(self.__tracks) if t not in track_ids]:
+            self.__tracks.pop(track_id, None)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / total if total > 0 else 0.}
+
+
+__decoder = None
+
+
 def unpack_fingerprint(source_image):
     """ Decodes and returns the encoded IDs present on the landing pad """
-    aruco_dist = cv2.aruco.Dictionary_get(cv2.aruco.DICT_6X6_250)
-    aruco_prms = cv2.aruco.DetectorParameters_create()
-    aruco_prms.cornerRefinementMethod = cv2.aruco.CORNER_REFINE_SUBPIX
+    global __decoder
+
+    if __decoder is None:
+        __decoder = FingerprintDecoder(refine=True)
+
+    return __decoder.decode(source_image)
+
 
-    _, ids, _ = cv2.aruco.detectMarkers(source_image, aruco_dist,
-                            parameters=aruco_prms)
+def unpack_fingerprints(source_image, boxes, coarse_size=None):
+    """ Decodes the IDs on each of the landing pads in `boxes` in one pass """
+    global __decoder
 
-    return [] if ids is None else ids
+    if __decoder is None:
+        __decoder = FingerprintDecoder(refine=True)
 
+    return __decoder.decode_boxes(source_image, boxes, coarse_size=coarse_size)
 
-def unpack_scene(source_image, bbox, debug=False):
+
+def find_base(gray_image, coarse_size=None):
+    """ Finds the contour and the four corners of the pad base in a gray ROI.
+
+    With `coarse_size` set, ROIs larger than that are searched on a copy
+    downscaled to `coarse_size` pixels and only the corners are refined at
+    full resolution, on the same blurred image as without it. Returns
+    (contour, corners) in ROI coordinates or (None, None).
+    """
+    scale = 1.
+    if coarse_size and max(gray_image.shape[:2]) > coarse_size:
+        scale = coarse_size / max(gray_image.shape[:2])
+
+    refine_image = cv2.GaussianBlur(gray_image, (15, 15), 0)
+    if scale < 1.:
+        search_image = cv2.resize(gray_image, None, fx=scale, fy=scale,
+                         interpolation=cv2.INTER_AREA)
+        ksize = max(3, int(15 * scale) | 1)
+        search_gblur = cv2.GaussianBlur(search_image, (ksize, ksize), 0)
+    else:
+        search_image = gray_image
+        search_gblur = refine_image
+
+    T, _ = cv2.threshold(search_gblur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # (closing with a 1x1 kernel, which this used to do, leaves the image unchanged)
+    b_image = cv2.Canny(search_image, 0.82 * T, T)
+
+    ret, base_contour = __extract_contours(b_image)
+    if not ret:
+        return (None, None)
+
+    ret, corners = __extract_corners(refine_image, base_contour, scale)
+    if not ret:
+        return (None, None)
+
+    if scale < 1.:
+        base_contour = base_contour / scale
+
+    return (base_contour, corners)
+
+
+def unpack_scene(source_image, bbox, debug=False, coarse_size=None):
     box = [clip_value(bbox[0], 0), clip_value(bbox[1], 0),
            clip_value(bbox[2], 0), clip_value(bbox[3], 0)]
     
@@ -108,19 +383,9 @@ def unpack_scene(source_image, bbox, debug=False):
                        box[0]:box[0] + (box[2] - box[0])]
 
     gray_image = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-    gray_gblur = cv2.GaussianBlur(gray_image, (15, 15), 0)
-    
-    T, _ = cv2.threshold(gray_gblur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-    b_image = cv2.Canny(gray_image, 0.82 * T, T)
-    b_image = cv2.morphologyEx(b_image, cv2.MORPH_CLOSE, 
-               np.ones((1, 1), np.uint8), iterations=10)
 
-    ret, base_contour = __extract_contours(b_image)
-    if not ret:
-        return (source_image, None, None, None)
-    
-    ret, corners = __extract_corners(gray_gblur, base=base_contour)
-    if not ret:
+    base_contour, corners = find_base(gray_image, coarse_size)
+    if corners is None:
         return (source_image, None, None, None)
     
     dim0, subject, corners = __associate(roi, box, corners)